@@ -5,10 +5,19 @@ import tib_utility.config as config
 import sqlite3
 import time
 import re
+import os
 import asyncio
+import tempfile
 import tib_utility.db_utils as db_utils
+import tib_utility.db_access as db_access
+import tib_utility.canvas_assets as canvas_assets
+import tib_utility.scheduler as scheduler
+import tib_utility.render_cache as render_cache
+import tib_utility.placemap_render as placemap_render
+import tib_utility.workers as workers
+import tib_utility.processes as processes
 from typing import Optional
-from tib_utility.db_utils import cursor, database, get_stats, generate_placemap, tpe_pixels_count_user, \
+from tib_utility.db_utils import get_stats, generate_placemap, tpe_pixels_count_user, \
     get_linked_pxls_username, tpe_pixels_count_canvas, description_format, CANVAS_REGEX, KEY_REGEX, resolve_name
 
 
@@ -23,8 +32,6 @@ class PlacemapDBAddAdmin(discord.ui.Modal, title='Force add a logkey'):
     key = discord.ui.TextInput(label='Log keys (512 char each)', placeholder='key1,key2,key3,key4,key5,key6', style=discord.TextStyle.paragraph, max_length=4000)
 
     async def on_submit(self, interaction: discord.Interaction) -> None:
-        query_logkey = "INSERT OR REPLACE INTO logkey VALUES (?, ?, ?)"
-        query_user = "INSERT OR IGNORE INTO users (user_id) VALUES (?)"
         try:
             if not await is_owner_check(interaction):
                 await interaction.response.send_message("You do not have permission to use this command :3", ephemeral=True)
@@ -58,9 +65,7 @@ class PlacemapDBAddAdmin(discord.ui.Modal, title='Force add a logkey'):
                         fail.append(f'c{canvas}, Invalid key format')
                         continue
                     try:
-                        cursor.execute(query_logkey, (user_id, canvas, key))
-                        cursor.execute(query_user, (user_id,))
-                        database.commit()
+                        await db_access.save_logkey(user_id, canvas, key)
                         success.append(f'c{canvas}')
                     except sqlite3.OperationalError as e:
                         fail.append(f'c{canvas}, SQLite error: {e}')
@@ -88,9 +93,7 @@ class PlacemapDBAddAdmin(discord.ui.Modal, title='Force add a logkey'):
                         fail.append(f'<@{user_id}> ({user_id}), Invalid key format')
                         continue
                     try:
-                        cursor.execute(query_logkey, (int(user_id), canvas, key))
-                        cursor.execute(query_user, (user_id,))
-                        database.commit()
+                        await db_access.save_logkey(int(user_id), canvas, key)
                         success.append(f'<@{user_id}> ({user_id})')
                     except sqlite3.OperationalError as e:
                         fail.append(f'{user_input}, SQLite error: {e}')
@@ -121,13 +124,11 @@ class Admin(commands.Cog): # this is for the actual Discord commands part
     @app_commands.describe(userid='The Discord user to link to.', username='The Pxls username to link.')
     async def pixels_db_link(self, interaction: discord.Interaction, userid: discord.User, username: str):
         """Link a Pxls username to a Discord user."""
-        query = "INSERT INTO users (user_id, username) VALUES (?, ?) ON CONFLICT(user_id) DO UPDATE SET username = ?"
         try:
             if not await is_owner_check(interaction):
                 await interaction.response.send_message("You do not have permission to use this command :3", ephemeral=True)
                 return
-            cursor.execute(query, (userid.id, username, username))
-            database.commit()
+            await db_access.link_user(userid.id, username)
             await interaction.response.send_message(f'Successfully linked **{username}** to **{userid}**!')
         except sqlite3.IntegrityError:
             await interaction.response.send_message(f'Error! The username **{username}** is already linked to another user.', ephemeral=True)
@@ -139,7 +140,6 @@ class Admin(commands.Cog): # this is for the actual Discord commands part
     @app_commands.describe(username='The Pxls username to unlink.')
     async def pixels_db_unlink(self, interaction: discord.Interaction, username: str):
         """Unlink a Pxls username from a Discord user."""
-        query = "UPDATE users SET username = NULL WHERE username = ?"
         if not re.fullmatch(r'^[a-zA-Z0-9_-]{1,32}$', username):
             await interaction.response.send_message('Invalid username', ephemeral=True)
             return
@@ -147,9 +147,7 @@ class Admin(commands.Cog): # this is for the actual Discord commands part
             if not await is_owner_check(interaction):
                 await interaction.response.send_message("You do not have permission to use this command :3", ephemeral=True)
                 return
-            cursor.execute(query, (username,))
-            database.commit()
-            if cursor.rowcount > 0:
+            if await db_access.unlink_user(username):
                 await interaction.response.send_message(f'Successfully unlinked **{username}**!')
             else:
                 await interaction.response.send_message(f'No linked user found for **{username}**.', ephemeral=True)
@@ -162,7 +160,6 @@ class Admin(commands.Cog): # this is for the actual Discord commands part
     @app_commands.describe(user='The user to add pixels to.', canvas='Canvas number (no c).', pixels='Amount placed.')
     async def pixels_db_add(self, interaction: discord.Interaction, user: str, canvas: str, pixels: int):
         """Add pixels to a user in the database. Needed values are user, canvas & pixels."""
-        query = "INSERT OR REPLACE INTO points VALUES (?, ?, ?)" # the reason we define query is to make sure cursor.execute isn't Huge
         current_channel = interaction.channel
         try:
             if not await is_owner_check(interaction):
@@ -173,11 +170,10 @@ class Admin(commands.Cog): # this is for the actual Discord commands part
             if not CANVAS_REGEX.fullmatch(canvas):
                 await interaction.response.send_message("Invalid format! A canvas code can only contain a-z and 0-9.", ephemeral=True)
                 return
-            prev_stats = get_stats(user) # so we can check for rank changes
+            prev_stats = await get_stats(user) # so we can check for rank changes
             prev_rank = prev_stats['rank']
-            cursor.execute(query, (str(user), canvas, pixels))
-            database.commit()
-            new_stats = get_stats(user)
+            await db_access.set_pixels(str(user), canvas, pixels)
+            new_stats = await get_stats(user)
             new_total = new_stats['total']
             new_rank = new_stats['rank']
             new_group  = new_stats['group']
@@ -214,14 +210,13 @@ class Admin(commands.Cog): # this is for the actual Discord commands part
         if not await is_owner_check(interaction):
             await interaction.followup.send("You do not have permission to use this command :3", ephemeral=True)
             return
-        cursor.execute('SELECT user_id FROM users WHERE notif_status = 1')
-        users_to_notify = cursor.fetchall()
+        users_to_notify = await db_access.notification_users()
         if not users_to_notify:
             await interaction.followup.send('No users to notify.', ephemeral=True)
             return
         async def notifying_users(users):
             notified_count = 0
-            for (user_id,) in users:
+            for user_id in users:
                 try:
                     user = self.client.get_user(user_id)
                     if user is None:
@@ -269,14 +264,15 @@ class Admin(commands.Cog): # this is for the actual Discord commands part
         await interaction.response.defer(ephemeral=False,thinking=True)
         if nofilter is not None:
             nofilter = nofilter
-        state, results = await generate_placemap(user, canvas, nofilter)
+        queue_status = db_utils.QueueStatus(interaction)
+        state, results = await generate_placemap(user, canvas, nofilter, priority=scheduler.ADMIN, on_queue=queue_status)
 
         if state:
             constructed_desc = await description_format(canvas, results)
             mode = results.get("mode", "0")
             user_log_file = results.get("user_log_file", "0")
         else:
-            await interaction.followup.send(results['error'])
+            await queue_status.send(results['error'])
             return
         pxls_username = await get_linked_pxls_username(user.id)
         if not pxls_username:
@@ -298,7 +294,7 @@ class Admin(commands.Cog): # this is for the actual Discord commands part
             end_time = time.time()
             elapsed_time = end_time - start_time
             print(f'/admin force-generate took {elapsed_time:.2f}s')
-            file = discord.File(results["output_path"], filename=results["filename"])
+            file = db_utils.placemap_file(results["output_path"], results["filename"])
             description=constructed_desc
             embed = discord.Embed(
                 title=f'Your Placemap for Canvas {canvas}', 
@@ -312,7 +308,8 @@ class Admin(commands.Cog): # this is for the actual Discord commands part
             embed.set_image(url=f'attachment://{results["filename"]}')
             embed.set_footer(text=f'Generated in {elapsed_time:.2f}s')
             view = db_utils.PlacemapAltView(user, canvas, mode, user_log_file)
-            await interaction.followup.send(embed=embed, file=file, view=view)
+            view.prerender()
+            await queue_status.send(embed=embed, file=file, view=view)
         except Exception as e:
             await interaction.response.send_message('Error! Something went wrong, check the console.', ephemeral=True)
             print(f'An error occurred: {e}')
@@ -332,8 +329,8 @@ class Admin(commands.Cog): # this is for the actual Discord commands part
             
             async def callback(used_canvas, idx, total):
                 """Update the message so you can see THINGS are HAPPENING."""
-                await progress.edit(content=f'Checking how many pixels <@{user.id}> has placed on all recorded TPE canvases... (c{used_canvas} {idx}/{total})')
-                print(f'Processing c{used_canvas} ({idx}/{total}) for user {user.id}')
+                await progress.edit(content=f'Checking how many pixels <@{user.id}> has placed on all recorded TPE canvases... (c{used_canvas} done, {idx}/{total})')
+                print(f'Processed c{used_canvas} ({idx}/{total}) for user {user.id}')
             results = await tpe_pixels_count_user(user.id, callback=callback)
             if not results:
                 await progress.edit(content=f'No logs found for <@{user.id}>')
@@ -417,8 +414,7 @@ class Admin(commands.Cog): # this is for the actual Discord commands part
                 await progress.edit(content=f'No logs found for c{canvas}, or there\'s no user data present.')
                 return
             
-            cursor.execute('SELECT user_id, username FROM users WHERE username IS NOT NULL')
-            linked_users = dict(cursor.fetchall())
+            linked_users = await db_access.linked_usernames()
             cleaned_results = sorted(results.keys(), key=lambda cleaned_user_id: results[cleaned_user_id].get('tpe_pixels', 0), reverse=True)
             header2 = f"{'User':<20} | {'Placed':>7} | {'For TPE':>7} | {'Griefed':>7}"
             header_seperator = f"{'-'*20}-+-{'-'*7}-+-{'-'*7}-+-{'-'*7}"
@@ -473,6 +469,108 @@ class Admin(commands.Cog): # this is for the actual Discord commands part
             await interaction.followup.send('Error! Something went wrong, check the console.', ephemeral=True)
             print(f'An error occurred: {e}')
 
+    @group.command(name='render-benchmark', description='Time render.exe against the in-process renderer for a user\'s placemap (ADMIN ONLY).')
+    @app_commands.describe(user='The user whose filtered log to render.', canvas='What canvas to render.')
+    async def render_benchmark(self, interaction: discord.Interaction, user: discord.User, canvas: str):
+        """Render every natively supported mode both ways (skipping the render cache) and compare how long each took."""
+        try:
+            if not await is_owner_check(interaction):
+                await interaction.response.send_message("You do not have permission to use this command :3", ephemeral=True)
+                return
+            if not CANVAS_REGEX.fullmatch(canvas):
+                await interaction.response.send_message('Invalid canvas format.', ephemeral=True)
+                return
+            user_log_file = f'{config.pxlslog_explorer_dir}/pxls-userlogs-tib/{user.id}_pixels_c{canvas}.log'
+            if not os.path.exists(user_log_file):
+                await interaction.response.send_message(f'No filtered log for {user} on c{canvas}, generate a placemap first.', ephemeral=True)
+                return
+            await interaction.response.defer(ephemeral=True, thinking=True)
+            header = f"{'Mode':<8} | {'exe (s)':>8} | {'native (s)':>10}"
+            header_seperator = f"{'-'*8}-+-{'-'*8}-+-{'-'*10}"
+            lines = []
+            # render.exe writes to a temporary file, the usual output path belongs to the user's placemaps & pre-renders
+            async with db_utils.job_scheduler.job(user.id, scheduler.ADMIN):
+                with tempfile.TemporaryDirectory(prefix='render-benchmark-') as output_dir:
+                    for mode in placemap_render.NATIVE_MODES:
+                        bg, palette_path, _ = config.paths(canvas, user.id, mode)
+                        exe_start = time.time()
+                        render_result, _, _ = await db_utils.render_exe(user, canvas, mode, user_log_file,
+                                                                        os.path.join(output_dir, f'{mode}.png'))
+                        exe_time = f'{time.time() - exe_start:.3f}' if render_result.returncode == 0 else 'failed'
+                        native_start = time.time()
+                        try:
+                            await db_utils.render_native(user_log_file, mode, palette_path, bg)
+                            native_time = f'{time.time() - native_start:.3f}'
+                        except Exception as e:
+                            print(f'Native {mode} render failed: {e}')
+                            native_time = 'failed'
+                        lines.append(f"{mode:<8} | {exe_time:>8} | {native_time:>10}")
+            embed = discord.Embed(
+                title=f'Render benchmark for {user} on c{canvas}',
+                description=f'```\n{header}\n{header_seperator}\n' + '\n'.join(lines) + '\n```', # AHH BACKTICKS
+                color=discord.Color.purple()
+                )
+            embed.set_footer(text=f"Native modes in use: {', '.join(sorted(config.native_render_modes())) or 'none'}")
+            await interaction.followup.send(embed=embed, ephemeral=True)
+        except Exception as e:
+            await interaction.followup.send('Error! Something went wrong, check the console.', ephemeral=True)
+            print(f'An error occurred: {e}')
+
+    @group.command(name='template-status', description='See template preloading, loading times and cache usage (ADMIN ONLY).')
+    async def template_status(self, interaction: discord.Interaction):
+        """Show the template warm-up time and per-canvas loading times."""
+        try:
+            if not await is_owner_check(interaction):
+                await interaction.response.send_message("You do not have permission to use this command :3", ephemeral=True)
+                return
+            warmup = db_utils.template_warmup
+            timings = db_utils.template_timings
+            if warmup['started'] is None:
+                warmup_line = 'Warm-up has not started.'
+            elif warmup['finished'] is None:
+                warmup_line = f'Warm-up running for {time.time() - warmup["started"]:.2f}s.'
+            else:
+                warmup_line = f'Warm-up took {warmup["finished"] - warmup["started"]:.2f}s.'
+            ready = len(db_utils.global_template_map)
+            queued = len(db_utils.template_pending)
+            header = f"{'Canvas':<6} | {'Seconds':>7} | {'Source':<8} | {'KiB':>7}"
+            header_seperator = f"{'-'*6}-+-{'-'*7}-+-{'-'*8}-+-{'-'*7}"
+            lines = []
+            for canvas, timing in sorted(timings.items(), key=lambda item: item[1]['seconds'], reverse=True):
+                lines.append(f"{'c'+canvas:<6} | {timing['seconds']:>7.3f} | {timing['source']:<8} | {timing['bytes'] / 1024:>7.1f}")
+            description = f'{warmup_line}\n{ready} canvases in memory, {queued} queued.'
+            for name, cache in (('Templates', db_utils.global_template_map), ('Canvases', canvas_assets.loaded_canvases)):
+                stats = cache.stats()
+                description += (f"\n{name}: {stats['size'] / 1024 / 1024:.1f}/{stats['budget'] / 1024 / 1024:.0f}MiB, "
+                                f"{stats['entries']} entries ({stats['pinned']} pinned), "
+                                f"{stats['hits']} hits, {stats['misses']} misses, {stats['evictions']} evictions")
+            stats = workers.worker_stats
+            description += (f"\nWorkers: {config.worker_processes()} processes, {stats['jobs']} jobs, "
+                            f"{stats['failed']} lost to dead workers, {stats['restarts']} restarts")
+            for stage, stats in processes.process_stats.items():
+                description += (f"\n{stage}.exe: {stats['runs']} runs, {stats['failed']} failed, "
+                                f"{stats['timeouts']} timed out, {stats['cancelled']} cancelled")
+            problems = db_utils.query_plan_problems
+            description += f"\nQuery plans: {f'{len(problems)} not using their indexes, check the console' if problems else 'all using their indexes'}"
+            stats = render_cache.stats()
+            description += (f"\nRenders: {stats['size'] / 1024 / 1024:.1f}/{stats['budget'] / 1024 / 1024:.0f}MiB, "
+                            f"{stats['entries']} cached, {stats['hits']} hits, {stats['misses']} misses "
+                            f"({stats['hit_rate'] * 100:.1f}% hit rate), {stats['evictions']} evictions")
+            if lines:
+                table = '\n'.join(lines)
+                if len(table) > 3800:
+                    table = table[:3800].rsplit('\n', 1)[0] + '\n...'
+                description += f'\n```\n{header}\n{header_seperator}\n{table}\n```' # AHH BACKTICKS
+            embed = discord.Embed(
+                title='Template loading',
+                description=description,
+                color=discord.Color.purple()
+                )
+            await interaction.response.send_message(embed=embed, ephemeral=True)
+        except Exception as e:
+            await interaction.response.send_message('Error! Something went wrong, check the console.', ephemeral=True)
+            print(f'An error occurred: {e}')
+
 async def setup(client):
     admin_guild = discord.Object(id=config.admin_server())
     dev_guild = discord.Object(id=config.dev_server())
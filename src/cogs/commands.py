@@ -2,7 +2,8 @@ import discord
 from discord import app_commands
 from discord.ext import commands
 from typing import Optional
-from tib_utility.db_utils import cursor, database, CANVAS_REGEX
+from tib_utility.db_utils import CANVAS_REGEX
+import tib_utility.db_access as db_access
 import tib_utility.config as config
 
 owner_id = config.owner()
@@ -121,25 +122,17 @@ class Commander(commands.Cog):
             interaction (discord.Interaction): Discord user.
         """
         try:
-            cursor.execute('INSERT OR IGNORE INTO users (user_id) VALUES (?)', (interaction.user.id,))
+            previous, _ = await db_access.toggle_notifications(interaction.user.id)
         except Exception as e:
             return await interaction.response.send_message(f'An error occurred while signing you up: {e}', ephemeral=True)
-        cursor.execute('SELECT notif_status FROM users WHERE user_id = ?', (interaction.user.id,))
-        result = cursor.fetchone()
-        if result is None:
-            cursor.execute('UPDATE users SET notif_status = 1 WHERE user_id = ?', (interaction.user.id,))
-            database.commit()
+        if previous is None:
             await interaction.response.send_message('You have been signed up for notifications!', ephemeral=True)
             print(f'{interaction.user} ({interaction.user.id}) signed up for notifications.')
         else:
-            if result[0] == 1:
-                cursor.execute('UPDATE users SET notif_status = 0 WHERE user_id = ?', (interaction.user.id,))
-                database.commit()
+            if previous == 1:
                 await interaction.response.send_message('You have been unsubscribed from notifications.', ephemeral=True)
                 print(f'{interaction.user} ({interaction.user.id}) unsubscribed from notifications.')
-            if result[0] == 0:
-                cursor.execute('UPDATE users SET notif_status = 1 WHERE user_id = ?', (interaction.user.id,))
-                database.commit()
+            if previous == 0:
                 await interaction.response.send_message('You have been re-subscribed to notifications!', ephemeral=True)
                 print(f'{interaction.user} ({interaction.user.id}) re-subscribed to notifications.')
 
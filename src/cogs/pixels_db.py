@@ -2,134 +2,109 @@ import discord
 from discord import app_commands, Interaction
 from discord.ext import commands
 import os
-from PIL import Image, ImageDraw, ImageFont
 import time
 import io
 import asyncio
 from tib_utility import config
-from tib_utility.db_utils import cursor, get_linked_pxls_username, get_linked_discord_username, get_stats, CANVAS_REGEX, USERNAME_REGEX, create_graph
+import tib_utility.db_access as db_access
+import tib_utility.leaderboard_render as leaderboard_render
+import tib_utility.scheduler as scheduler
+from tib_utility.db_utils import get_linked_pxls_username, get_linked_discord_username, get_stats, CANVAS_REGEX, USERNAME_REGEX, create_graph
 from typing import Optional
 
-def create_pages(items: list, page: int, page_size: int = 30):
-    """Function to determine the amount of pages & what goes where."""
-    total_pages = (len(items) + page_size - 1) // page_size
+def create_pages(total_items: int, page: int, page_size: int = 30) -> tuple[int, int, int]:
+    """Function to determine the amount of pages & what goes where.
+
+    Returns:
+        tuple[int, int, int]: The page (clamped to the ones that exist), the offset of its first item and the amount of pages.
+    """
+    total_pages = max(1, (total_items + page_size - 1) // page_size)
     page = max(1, min(page, total_pages))
-    start = (page - 1) * page_size
-    return items[start:start + page_size], total_pages
+    return page, (page - 1) * page_size, total_pages
+
+page_flights = scheduler.SingleFlight() # keyed like leaderboard_render.page_cache, so a page is only ever rendered once at a time
 
 class LeaderboardView(discord.ui.View):
-    def __init__(self, all_pixels: list, font_path: str, font_size: int, page_size: int = 30, timeout: Optional[float] = 60, canvas: Optional[str] = None):
+    """/list pages, fetched from the DB and rendered (off the event loop) one at a time as they're shown.
+
+    Rendered pages are cached in leaderboard_render.page_cache, and the pages before & after the one being shown are
+    rendered in the background so Prev/Next usually have theirs ready.
+    """
+    def __init__(self, font_path: str, font_size: int, page_size: int = 30, timeout: Optional[float] = 60, canvas: Optional[str] = None):
         super().__init__(timeout=timeout)
-        self.all_pixels = all_pixels
         self.font_path = font_path
         self.font_size = font_size
         self.page_size = page_size
         self.canvas = canvas
         self.current_page = 1
-        self.total_pages = (len(all_pixels) + page_size - 1) // page_size
+        self.total_pages = 1
+        self.total_pixels = 0
+        self.total_users = 0
+        self.version = 0
         self.spacing = 18
-    
-    def generate_embed(self):
-        """Generate an embed for /list, applies to pages too."""
-        # getting page function, font, and headers
-        page_pixels, _ = create_pages(self.all_pixels, self.current_page, self.page_size)
-        font = ImageFont.truetype(self.font_path, self.font_size)
-        spacing = self.spacing
-        top_adjustment = 2
-        bottom_adjustment = 3
-
-        bg_color = (24, 4, 53)
-        header_color = (75, 0, 130)
-        even_row_color = (34, 11, 76)
-        odd_row_color = (29, 8, 65)
-        border_color = (138, 43, 226)
-        text_color = (255, 255, 255)
+        self.prefetches: list[tuple[tuple, asyncio.Task]] = []
 
-        headers = ["Rank", "Username", "Pixels"]
-        temp_image = Image.new("RGB", (1, 1))
-        temp_draw = ImageDraw.Draw(temp_image)
+    async def load_page(self):
+        """Fetch the header numbers (and the data version pages are cached by), and clamp current_page to the pages that exist."""
+        self.total_pixels, self.total_users, self.version = await db_access.leaderboard_summary(self.canvas)
+        self.current_page, _, self.total_pages = create_pages(self.total_users, self.current_page, self.page_size)
 
-        ranks_value = [
-            str(rank) for rank in range(1 + (self.current_page - 1) * self.page_size,
-                                        1 + (self.current_page - 1) * self.page_size + len(page_pixels))
-                                        ]
-        ranks_width = max(temp_draw.textbbox((0, 0), text, font=font)[2] for text in (headers[0], *ranks_value)) + 10
+    def page_key(self, page: int) -> tuple:
+        return self.canvas, page, self.page_size, self.version
 
-        usernames = [user for user, _ in page_pixels]
-        usernames_width = max(temp_draw.textbbox((0, 0), text, font=font)[2] for text in (headers[1], *usernames)) + 10
-
-        pixels = [str(total) for _, total in page_pixels]
-        pixels_width = max(temp_draw.textbbox((0, 0), text, font=font)[2] for text in (headers[2], *pixels)) + 10
-
-        ranks_start = spacing
-        usernames_start = ranks_start + ranks_width + spacing
-        pixels_start = usernames_start + usernames_width + spacing
-
-        ascent, descent = font.getmetrics()
-        headers_height = ascent + descent + 10
-        rows_height = headers_height
-        image_width = pixels_start + pixels_width + spacing
-        image_height = headers_height + (rows_height * len(page_pixels)) + bottom_adjustment
-        image = Image.new("RGB", (image_width, image_height), color=bg_color)
-        draw = ImageDraw.Draw(image)
-        # header colour
-        draw.rectangle([0, 0, image_width, spacing + top_adjustment + headers_height], fill=header_color)
-
-        # headers
-        for idx, text in enumerate(headers):
-            if idx == 0:
-                start = ranks_start
-                width = ranks_width
-            elif idx == 1:
-                start = usernames_start
-                width = usernames_width
-            else:
-                start = pixels_start
-                width = pixels_width
-            pos_x = start + (width / 2)
-            pos_y = top_adjustment + headers_height / 2 - 1
-            draw.text((pos_x, pos_y), text, fill=text_color, font=font, anchor="mm")
-
-        # rows
-        y = headers_height
-        for i, (user, total_all) in enumerate(page_pixels):
-            row_color = even_row_color if i % 2 == 0 else odd_row_color
-            draw.rectangle([0, y, image_width, y + rows_height], fill=row_color)
+    async def render_page(self, page: int, key: tuple, background: bool = False) -> Optional[bytes]:
+        """Fetch the rows of a page, render it in a thread and cache it under key. In the background, failing only returns None."""
+        try:
+            _, offset, _ = create_pages(self.total_users, page, self.page_size)
+            rows = await db_access.leaderboard_page(self.canvas, self.page_size, offset)
+            page_pixels = [(str(user), total_all) for user, total_all in rows]
+            png = await asyncio.to_thread(leaderboard_render.render_png, page_pixels, offset + 1, self.font_path, self.font_size, self.spacing)
+        except Exception as e:
+            if not background:
+                raise
+            print(f'Failed to prerender leaderboard page {page}: {e}')
+            return None
+        leaderboard_render.page_cache[key] = png
+        return png
 
-            for idx, (text, start, width) in enumerate([
-                (str(i + 1 + (self.current_page - 1) * self.page_size), ranks_start, ranks_width),
-                (user, usernames_start, usernames_width),
-                (str(total_all), pixels_start, pixels_width)
-            ]):
-                pos_x = start + (width / 2)
-                pos_y = y + rows_height / 2 - 1
-                draw.text((pos_x, pos_y), text, fill="white", font=font, anchor="mm")
-            y += rows_height
+    async def page_png(self, page: int) -> bytes:
+        """The rendered page, from the cache, a prerender that's already running, or rendered now."""
+        key = self.page_key(page)
+        png = leaderboard_render.page_cache.get(key)
+        if png is None:
+            png = await page_flights.run(key, lambda: self.render_page(page, key))
+        if png is None: # attached to a prerender that failed
+            png = await self.render_page(page, key)
+        return png
 
-        # draw border (last)
-        draw.rectangle([0, 0, image_width - 1, image_height - 1], outline=border_color, width=2)
+    def prefetch(self):
+        """Start rendering the previous & next pages (wrapping around like the buttons do) in the background."""
+        for page in {self.current_page % self.total_pages + 1, (self.current_page - 2) % self.total_pages + 1} - {self.current_page}:
+            key = self.page_key(page)
+            if key not in leaderboard_render.page_cache:
+                self.prefetches.append((key, page_flights.start(key, lambda page=page, key=key: self.render_page(page, key, background=True))))
+        self.prefetches = [(key, task) for key, task in self.prefetches if not task.done()]
 
+    async def generate_embed(self):
+        """Generate an embed for /list, applies to pages too."""
+        png = await self.page_png(self.current_page)
+        self.prefetch()
         embed = discord.Embed(color=discord.Color.purple()) # moved here so the canvas check is only done once
-        with io.BytesIO() as image_binary: # below sends the embed w/ the image
-            image.save(image_binary, 'PNG')
-            image_binary.seek(0)
-            
-            if self.canvas:
-                file = discord.File(fp=image_binary, filename=f'c{self.canvas}_leaderboard.png')
-                embed.set_image(url=f"attachment://c{self.canvas}_leaderboard.png")
-                embed.title = f"TPE c{self.canvas} Leaderboard"
-            else:
-                file = discord.File(fp=image_binary, filename='alltime_leaderboard.png')
-                embed.set_image(url="attachment://alltime_leaderboard.png")
-                embed.title = "TPE all-time Leaderboard"
-                
-        embed.description = f"Total pixels recorded: **{sum(total for _, total in self.all_pixels)}**\n"
-        embed.description += f"Total users recorded: **{len(self.all_pixels)}**"
+        filename = f'c{self.canvas}_leaderboard.png' if self.canvas else 'alltime_leaderboard.png'
+        file = discord.File(fp=io.BytesIO(png), filename=filename) # below sends the embed w/ the image
+        embed.set_image(url=f"attachment://{filename}")
+        embed.title = f"TPE c{self.canvas} Leaderboard" if self.canvas else "TPE all-time Leaderboard"
+        embed.description = f"Total pixels recorded: **{self.total_pixels}**\n"
+        embed.description += f"Total users recorded: **{self.total_users}**"
         return embed, file
 
+    async def on_timeout(self):
+        for key, task in self.prefetches:
+            page_flights.drop(key, task)
 
     async def pages_embed(self, interaction: Interaction, start_time: float):
-        embed, file = self.generate_embed()
+        await self.load_page()
+        embed, file = await self.generate_embed()
         end_time = time.time()
         elapsed_time = end_time - start_time
         embed.set_footer(text=f'Generated in {elapsed_time:.2f}s\nPage {self.current_page}/{self.total_pages}')
@@ -193,7 +168,7 @@ class Database(commands.Cog):
             if not internal_pxls_username:
                 await interaction.response.send_message(f'You do not have a linked Pxls username (yet).', ephemeral=True)
                 return
-        stats = get_stats(internal_pxls_username)
+        stats = await get_stats(internal_pxls_username)
         total = stats['total']
         rank = stats['rank']
         group = stats['group']
@@ -211,16 +186,6 @@ class Database(commands.Cog):
             if not CANVAS_REGEX.fullmatch(canvas):
                 await interaction.response.send_message('Invalid format! A canvas code can only contain a-z and 0-9.', ephemeral=True)
                 return
-            get_users_canvas = "SELECT user, SUM(pixels) as total_all FROM points WHERE canvas=? GROUP BY user ORDER BY total_all DESC"
-            cursor.execute(get_users_canvas, (canvas,)) # does the above
-        else: 
-            get_users_all = "SELECT user, SUM(pixels) as total_all FROM points GROUP BY user ORDER BY total_all DESC"
-            cursor.execute(get_users_all) # does the above
-        all_pixels = cursor.fetchall() # defines all_pixels to be the thing we got from the database
-        if not all_pixels:
-            await interaction.response.send_message('No pixels or users found.')
-            return # self-explanatory but if "all_pixels" is empty it returns this. I love error handling :3
-        all_pixels = [(str(user), total_all) for user, total_all in all_pixels]
 
         cog_dir = os.path.dirname(os.path.abspath(__file__))
         src_dir = os.path.dirname(cog_dir)
@@ -228,8 +193,12 @@ class Database(commands.Cog):
         font_size = 24
         page_size = 30
 
-        view = LeaderboardView(all_pixels, font_path, font_size, page_size, canvas=canvas)
-        embed, file = view.generate_embed()
+        view = LeaderboardView(font_path, font_size, page_size, canvas=canvas)
+        await view.load_page() # only the first page, the others are fetched when someone goes to them
+        if not view.total_users:
+            await interaction.response.send_message('No pixels or users found.')
+            return # self-explanatory but if there's nobody on the leaderboard it returns this. I love error handling :3
+        embed, file = await view.generate_embed()
         end_time = time.time()
         elapsed_time = end_time - start_time
         embed.set_footer(text=f'Generated in {elapsed_time:.2f}s\nPage {view.current_page}/{view.total_pages}')
@@ -270,8 +239,7 @@ class Database(commands.Cog):
                 return
         # handles the Graphering
         try:
-            cursor.execute("SELECT canvas, pixels FROM points WHERE user = ?", (internal_pxls_username,))
-            data = cursor.fetchall()
+            data = await db_access.user_canvas_pixels(internal_pxls_username)
             if not data:
                 await interaction.followup.send(f'No data found for {internal_pxls_username}.', ephemeral=True)
                 return
@@ -293,7 +261,7 @@ class Database(commands.Cog):
                 canvases.append(f"c{c}")
                 pixels.append(data[c] if c in data else 0)
             
-            stats = get_stats(internal_pxls_username)
+            stats = await get_stats(internal_pxls_username)
             rank = stats['rank']
             group = stats['group']
             image_buffer = await asyncio.to_thread(create_graph, canvases, pixels)
@@ -326,10 +294,8 @@ class Database(commands.Cog):
         await interaction.response.defer(thinking=True)
         start_time = time.time()
         try:
-            cursor.execute("SELECT canvas, SUM(pixels) FROM points GROUP BY canvas")
-            data = cursor.fetchall()
-            cursor.execute("SELECT COUNT(DISTINCT user) FROM points")
-            active_users = cursor.fetchone()[0]
+            data = await db_access.canvas_totals()
+            active_users = await db_access.active_user_count()
             if not data:
                 await interaction.followup.send('No data found.', ephemeral=True)
                 return
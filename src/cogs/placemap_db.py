@@ -8,7 +8,8 @@ from typing import Optional
 # from collections import defaultdict # used previously, cannot remember if this was for error handling or not
 import tib_utility.config as config
 import tib_utility.db_utils as db_utils
-from tib_utility.db_utils import cursor, database, generate_placemap, get_linked_pxls_username, description_format, filter, CANVAS_REGEX, KEY_REGEX, ROOT_DIR, pixel_counting
+import tib_utility.db_access as db_access
+from tib_utility.db_utils import generate_placemap, get_linked_pxls_username, description_format, filter_many, CANVAS_REGEX, KEY_REGEX, ROOT_DIR, analyze_user_log, get_template_raster
 import tempfile
 import os
 import shutil
@@ -37,12 +38,8 @@ class PlacemapDBAdd(discord.ui.Modal, title='Add your log key.'):
             return
         
         user = interaction.user
-        query = "INSERT OR REPLACE INTO logkey VALUES (?, ?, ?)" # the three question marks represents the above "user", "canvas", and "logkey"
-        query_user = "INSERT OR IGNORE INTO users (user_id) VALUES (?)"
         try:
-            cursor.execute(query, (user.id, self.canvas.value, self.key.value)) # we use user.id to store the ID instead of the user string - das bad
-            cursor.execute(query_user, (user.id,))
-            database.commit()
+            await db_access.save_logkey(user.id, self.canvas.value, self.key.value) # we use user.id to store the ID instead of the user string - das bad
             print(f'Log key added for {user} ({user.id}) on canvas {self.canvas.value}.')
             await interaction.response.send_message(f'Added key for canvas {self.canvas.value}!', ephemeral=True)
             return
@@ -84,45 +81,47 @@ class PlacemapDBCheckKeysFromUser(discord.ui.Modal, title='Input desired logkeys
         if not os.path.exists(logfile):
             await interaction.edit_original_response(content='No log file available for this canvas.')
             return
-        palette_path, initial_canvas_path = config.palette_initial_paths(self.canvas)
+        template = await get_template_raster(self.canvas, self.template_paths)
+        if template is None:
+            await interaction.edit_original_response(content='Could not load the templates or the initial canvas for this canvas.')
+            if os.path.exists(self.temp_dir):
+                shutil.rmtree(self.temp_dir)
+            return
         
         results = {}
         errors = []
         
+        user_log_files = {}
         for idx, user_key in enumerate(logkeys, start=1):
-            users = f'User {idx}'
             if not KEY_REGEX.fullmatch(user_key):
                 errors.append(f'Invalid format for log key {idx}! A logkey can only contain a-z and 0-9.')
                 continue
-            with tempfile.NamedTemporaryFile(mode='w+', delete=False, suffix='.log') as temp_log:
-                user_log_file = temp_log.name
-            success = await filter(self.canvas, user_key, logfile, user_log_file)
-            if not success:
+            if user_key not in user_log_files:
+                with tempfile.NamedTemporaryFile(mode='w+', delete=False, suffix='.log') as temp_log:
+                    user_log_files[user_key] = temp_log.name
+        filtered = await filter_many(self.canvas, user_log_files, logfile) if user_log_files else {}
+
+        for idx, user_key in enumerate(logkeys, start=1):
+            users = f'User {idx}'
+            if user_key not in filtered:
+                continue
+            user_log_file = user_log_files[user_key]
+            if not filtered[user_key]:
                 errors.append(f'Filtering failed for log key {idx}.')
-                if os.path.exists(user_log_file):
-                    os.unlink(user_log_file)
                 continue
             try:
-                correct_pixels, grief_pxiels = await db_utils.tpe_pixels_count(
-                    user_log_file,
-                    temp_pattern='',
-                    palette_path=palette_path,
-                    initial_canvas_path=initial_canvas_path,
-                    logkey_check_from_user=True,
-                    template_from_user=self.template_paths
-                )
-                total_pixels, undo, mod = await pixel_counting(user_log_file)
+                stats = await analyze_user_log(user_log_file, template=template)
                 results[users] = {
-                    'total': total_pixels,
-                    'correct': correct_pixels,
-                    'grief': grief_pxiels
+                    'total': stats['total_pixels'],
+                    'correct': stats['tpe_pixels'],
+                    'grief': stats['tpe_griefs']
                 }
             except Exception as e:
                 errors.append(f'An error occurred while counting pixels for log key {idx}')
                 print(f'An error occurred while counting pixels for log key {idx}: {e}')
-            finally:
-                if os.path.exists(user_log_file):
-                    os.unlink(user_log_file)
+        for user_log_file in user_log_files.values():
+            if os.path.exists(user_log_file):
+                os.unlink(user_log_file)
         if not results:
             if not errors:
                 errors.append('No log keys were processed.')
@@ -217,7 +216,7 @@ class Placemap(commands.Cog):
         await interaction.response.send_message(embed=embed, view=view)
 
     @group.command(name='generate', description='Generate a placemap from a log key.')
-    @app_commands.describe(canvas='What canvas to generate the placemap for.', nofilter='Skip filtering (only for repeat pladcemaps)')
+    @app_commands.describe(canvas='What canvas to generate the placemap for.', nofilter='Always reuse your last filtered log (unchanged keys are reused automatically)')
     async def placemap_db_generate(self, interaction: discord.Interaction, canvas: str, nofilter: Optional[bool] = False):
         """Generate a placemap by piping the necessary arguments to pxlslog-explorer.
 
@@ -233,10 +232,11 @@ class Placemap(commands.Cog):
         if nofilter is not None:
             nofilter = nofilter
         await interaction.response.defer(ephemeral=False,thinking=True)
-        state, results = await generate_placemap(user, canvas, nofilter)
+        queue_status = db_utils.QueueStatus(interaction)
+        state, results = await generate_placemap(user, canvas, nofilter, on_queue=queue_status)
 
         if not state:
-            await interaction.followup.send(results['error'])
+            await queue_status.send(results['error'])
             return
         constructed_desc = await description_format(canvas, results)
         mode = results.get("mode", "0")
@@ -261,7 +261,7 @@ class Placemap(commands.Cog):
             end_time = time.time()
             elapsed_time = end_time - start_time
             print(f'/logkey generate took {elapsed_time:.2f}s')
-            file = discord.File(results["output_path"], filename=results["filename"])
+            file = db_utils.placemap_file(results["output_path"], results["filename"])
             description=constructed_desc
             embed = discord.Embed(
                 title=f'Your Placemap for Canvas {canvas}', 
@@ -275,7 +275,8 @@ class Placemap(commands.Cog):
             embed.set_image(url=f'attachment://{results["filename"]}')
             embed.set_footer(text=f'Generated in {elapsed_time:.2f}s')
             view = db_utils.PlacemapAltView(user, canvas, mode, user_log_file)
-            await interaction.followup.send(embed=embed, file=file, view=view)
+            view.prerender()
+            await queue_status.send(embed=embed, file=file, view=view)
         except Exception as e:
             await interaction.response.send_message('Error! Something went wrong, check the console.', ephemeral=True)
             print(f'An error occurred: {e}')
@@ -289,14 +290,11 @@ class Placemap(commands.Cog):
             interaction (discord.Interaction): Who to generate it for (Discord user).
         """
         user = interaction.user
-        query = "SELECT canvas FROM logkey WHERE user = ? ORDER BY CAST(canvas AS INTEGER) DESC, canvas DESC"
         try:
-            cursor.execute(query, (user.id,))
-            results = cursor.fetchall()
-            if not results:
+            canvases = await db_access.logkey_canvases(user.id)
+            if not canvases:
                 await interaction.response.send_message('No log keys found for your user!', ephemeral=True)
                 return
-            canvases = [str(row[0]) for row in results]
             cols = 4
             rows_count = (len(canvases) + cols - 1) // cols
             rows = []
@@ -1,4 +1,3 @@
-import asyncio
 import os
 import sys
 import sqlite3
@@ -9,19 +8,18 @@ SRC_DIR = os.path.dirname(CUR_DIR)
 sys.path.append(SRC_DIR)
 
 
-from tib_utility.db_utils import cursor, database, get_all_users, get_linked_discord_username, get_linked_pxls_username, CANVAS_REGEX, KEY_REGEX
+import tib_utility.db_access as db_access # used synchronously (this thread's connection), no event loop needed here
+from tib_utility.db_utils import CANVAS_REGEX, KEY_REGEX
 import tkinter
 from tkinter import messagebox, ttk
 
 
-async def find_data():
+def find_data():
     """Find all userdata in the DB."""
-    users = get_all_users()
+    users = db_access.fetch_all(db_access.ALL_USERS)
     users_db_data = {str(row[1]): row[0] for row in users} # since this returns (user_id, username)
     
-    pixel_query = "SELECT user, SUM(pixels) as total_all FROM points GROUP BY user"
-    cursor.execute(pixel_query)
-    pixels_db_data = {str(row[0]): row[1] for row in cursor.fetchall()} # since this returns (user, pixels)
+    pixels_db_data = {str(row[0]): row[1] for row in db_access.fetch_all(db_access.LEADERBOARD)} # since this returns (user, pixels)
     
     all_pixels = set(users_db_data.keys()) | set(pixels_db_data.keys())
     
@@ -39,21 +37,21 @@ async def find_data():
 
 def refresh_data():
     """Query the DB to refresh stats."""
-    data = asyncio.run(find_data())
+    data = find_data()
     for row in tree.get_children():
         tree.delete(row)
     for row in data:
         tree.insert('', 'end', values=row)
 
 
-async def resolve_user_gui(identifier: str):
+def resolve_user_gui(identifier: str):
     identifier = identifier.strip()
     if identifier.isdigit() and len(identifier) > 16:
         return int(identifier)
 
-    linked_id = await get_linked_discord_username(identifier)
-    if linked_id:
-        return int(linked_id)
+    row = db_access.fetch_one(db_access.LINKED_DISCORD_ID, (identifier,))
+    if row and row[0]:
+        return int(row[0])
     return None
 
 
@@ -83,8 +81,6 @@ def logkey_add(): # /admin force-add but GUI form!
             messagebox.showwarning("Error", "You must provide at least one user and canvas.")
             return
 
-        query_logkey = "INSERT OR REPLACE INTO logkey VALUES (?, ?, ?)"
-        query_user = "INSERT OR IGNORE INTO users (user_id) VALUES (?)"
         try:
             first_item = user_canvases[0]
             is_canvas_many = not CANVAS_REGEX.fullmatch(first_item)
@@ -92,7 +88,7 @@ def logkey_add(): # /admin force-add but GUI form!
             if is_canvas_many:  # one user, multiple canvases
                 user_input = user_canvases[0]
                 canvases = user_canvases[1:]
-                user_id = asyncio.run(resolve_user_gui(user_input))
+                user_id = resolve_user_gui(user_input)
                 if not user_id:
                     messagebox.showerror("Error", f"Could not find a linked name for {user_input}. Are you sure you typed it correctly or that they\'re linked?")
                     return
@@ -109,16 +105,15 @@ def logkey_add(): # /admin force-add but GUI form!
                         fail.append(f"c{canvas}, Invalid key format")
                         continue
                     try:
-                        cursor.execute(query_logkey, (user_id, canvas, key))
-                        cursor.execute(query_user, (user_id,))
-                        database.commit()
+                        db_access.save_logkey_sync(user_id, canvas, key)
                         success.append(f"c{canvas}")
                     except sqlite3.OperationalError as e:
                         fail.append(f"c{canvas}, SQLite error: {e}")
                     except Exception as e:
                         fail.append(f"c{canvas}, Error: {e}")
                         
-                find_username = asyncio.run(get_linked_pxls_username(user_id))
+                row = db_access.fetch_one(db_access.LINKED_USER, (user_id,))
+                find_username = row[0] if row else None
                 message = f"{find_username} ({user_id}) now has keys for canvases: {', '.join(success)}"
                 if fail:
                     message += f"\nFailed for canvases: {', '.join(fail)}"
@@ -134,16 +129,14 @@ def logkey_add(): # /admin force-add but GUI form!
                 success = []
                 fail = []
                 for user_input, key in zip(user_inputs, keys):
-                    user_id = asyncio.run(resolve_user_gui(user_input))
+                    user_id = resolve_user_gui(user_input)
                     if not user_id:
                         fail.append(f"{user_input}, Invalid user format")
                     if not KEY_REGEX.fullmatch(key):
                         fail.append(f"c{user_input}, Invalid key format")
                         continue
                     try:
-                        cursor.execute(query_logkey, (user_id, canvas, key))
-                        cursor.execute(query_user, (user_id,))
-                        database.commit()
+                        db_access.save_logkey_sync(user_id, canvas, key)
                         success.append(f"c{canvas}")
                     except sqlite3.OperationalError as e:
                         fail.append(f"c{canvas}, SQLite error: {e}")
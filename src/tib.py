@@ -1,110 +1,119 @@
 import asyncio
-import discord
-from discord.ext import commands
 import os
 from dotenv import load_dotenv
 import logging
 import tib_utility.config as config
-import tib_utility.db_utils as db_utils
 import importlib
 
 load_dotenv()
 
-handler = logging.FileHandler(filename='discord.log', encoding='utf-8', mode='w')
-intents = discord.Intents.default()
-intents.guilds = True
-bot = commands.Bot(command_prefix='>', intents=intents)
-tree = bot.tree
-owner_id = config.owner()
+# The worker pools spawn their processes, which re-import this file as __mp_main__. Everything that has side effects
+# (the log file, the bot, db_utils and its migrations) is set up in create_bot() so the workers only get the imports above.
 
-@bot.event
-async def on_ready():
-    print(f'Started. Logged in as {bot.user}.')
-    status = discord.CustomActivity(name="Watching over Pxls logs | /help")
-    await bot.change_presence(activity=status)
-    asyncio.create_task(db_utils.preload_canvas_cache())
+def create_bot():
+    """Build the bot and register the commands in this file."""
+    import discord
+    from discord.ext import commands
+    import tib_utility.db_utils as db_utils
 
-async def load():
-    for filename in os.listdir('./cogs'):
-        if filename.endswith('.py'):
-            try:
-                await bot.load_extension(f'cogs.{filename[:-3]}') # :-3 literally just strips the last three characters on the file name, which is .py
-            except Exception as e:
-                print(f'Failed to load {filename[:-3]}: {e}')
+    intents = discord.Intents.default()
+    intents.guilds = True
+    bot = commands.Bot(command_prefix='>', intents=intents)
+    tree = bot.tree
+    owner_id = config.owner()
 
+    @bot.event
+    async def on_ready():
+        print(f'Started. Logged in as {bot.user}.')
+        status = discord.CustomActivity(name="Watching over Pxls logs | /help")
+        await bot.change_presence(activity=status)
+        asyncio.create_task(db_utils.preload_canvas_cache())
 
-bot_close = bot.close
-async def cleanup():
-    db_utils.db_shutdown() # make sure files are synced properly
-    await bot_close()
-bot.close = cleanup
-                
-# all commands in this file are just for making sure the bot Actually Works
-@tree.command(name='shutdown', description='Shut down the bot (ADMIN ONLY)')
-async def shutdown(interaction: discord.Interaction):
-    """Goodnight, sweet prince."""
-    if interaction.user.id != owner_id:
-        await interaction.response.send_message("You do not have permission to use this command :3", ephemeral=True)
-        return
-    await interaction.response.send_message("Shutting down...")
-    await bot.close()
+    bot_close = bot.close
+    async def cleanup():
+        db_utils.db_shutdown() # make sure files are synced properly
+        await bot_close()
+    bot.close = cleanup
 
-@tree.command(name='sync', description='Sync (ADMIN ONLY)')
-async def sync(interaction: discord.Interaction):
-    """Sync commands to Discord (DO NOT SPAM)"""
-    if interaction.user.id != owner_id:
-        await interaction.response.send_message("You do not have permission to use this command :3", ephemeral=True)
-        return
-    fmt = await tree.sync()
-    await interaction.response.send_message('Synced commands.', ephemeral=True)
-    print(f'Synced {len(fmt)} commands globally.')
+    # all commands in this file are just for making sure the bot Actually Works
+    @tree.command(name='shutdown', description='Shut down the bot (ADMIN ONLY)')
+    async def shutdown(interaction: discord.Interaction):
+        """Goodnight, sweet prince."""
+        if interaction.user.id != owner_id:
+            await interaction.response.send_message("You do not have permission to use this command :3", ephemeral=True)
+            return
+        await interaction.response.send_message("Shutting down...")
+        await bot.close()
 
-@tree.command(name='sync-admin', description='Sync admin commands (ADMIN ONLY)')
-async def sync_admin(interaction: discord.Interaction):
-    """Sync admin commands to the admin server only."""
-    fmt = []
-    if interaction.user.id != owner_id:
-        await interaction.response.send_message("You do not have permission to use this command :3", ephemeral=True)
-        return
-    guild_list = [config.admin_server(), config.dev_server()]
-    for guild_id in guild_list:
-        guild_object = discord.Object(id=guild_id)
-        fmt = await tree.sync(guild=guild_object)
-    await interaction.response.send_message('Synced admin commands.', ephemeral=True)
-    print(f'Synced {len(fmt)} admin commands to admin server.')
+    @tree.command(name='sync', description='Sync (ADMIN ONLY)')
+    async def sync(interaction: discord.Interaction):
+        """Sync commands to Discord (DO NOT SPAM)"""
+        if interaction.user.id != owner_id:
+            await interaction.response.send_message("You do not have permission to use this command :3", ephemeral=True)
+            return
+        fmt = await tree.sync()
+        await interaction.response.send_message('Synced commands.', ephemeral=True)
+        print(f'Synced {len(fmt)} commands globally.')
 
-@tree.command(name='reload-cogs', description='Reload the cogs (ADMIN ONLY)')
-async def reload_cogs(interaction: discord.Interaction):
-    """Reload all cogs present within the bot. They can't be used otherwise (esp if you add new code)"""
-    if interaction.user.id != owner_id:
-        await interaction.response.send_message("You do not have permission to use this command :3", ephemeral=True)
-        return
-    reload = []
-    importlib.reload(config)
-    importlib.reload(db_utils)
-    # reload.append(f'Config successfully reloaded.') # doesn't seem to work
-    print('config successfully reloaded.')
+    @tree.command(name='sync-admin', description='Sync admin commands (ADMIN ONLY)')
+    async def sync_admin(interaction: discord.Interaction):
+        """Sync admin commands to the admin server only."""
+        fmt = []
+        if interaction.user.id != owner_id:
+            await interaction.response.send_message("You do not have permission to use this command :3", ephemeral=True)
+            return
+        guild_list = [config.admin_server(), config.dev_server()]
+        for guild_id in guild_list:
+            guild_object = discord.Object(id=guild_id)
+            fmt = await tree.sync(guild=guild_object)
+        await interaction.response.send_message('Synced admin commands.', ephemeral=True)
+        print(f'Synced {len(fmt)} admin commands to admin server.')
+
+    @tree.command(name='reload-cogs', description='Reload the cogs (ADMIN ONLY)')
+    async def reload_cogs(interaction: discord.Interaction):
+        """Reload all cogs present within the bot. They can't be used otherwise (esp if you add new code)"""
+        if interaction.user.id != owner_id:
+            await interaction.response.send_message("You do not have permission to use this command :3", ephemeral=True)
+            return
+        reload = []
+        importlib.reload(config)
+        importlib.reload(db_utils)
+        # reload.append(f'Config successfully reloaded.') # doesn't seem to work
+        print('config successfully reloaded.')
+        for filename in os.listdir('./cogs'):
+            if filename.endswith('.py'):
+                try:
+                    await bot.reload_extension(f'cogs.{filename[:-3]}')
+                    print(f'{filename[:-3]} successfully reloaded.')
+                    reload.append(f'{filename[:-3]} successfully reloaded.')
+                except Exception as e:
+                    print(f'Failed to reload {filename[:-3]}: {e}')
+                    reload.append(f'Failed to reload {filename[:-3]}, check terminal.')
+        if reload:
+            message = '\n'.join(reload)
+        else:
+            message = 'No cogs found.'
+        await interaction.response.send_message(message, ephemeral=True)
+
+    return bot
+
+async def load(bot):
     for filename in os.listdir('./cogs'):
         if filename.endswith('.py'):
             try:
-                await bot.reload_extension(f'cogs.{filename[:-3]}')
-                print(f'{filename[:-3]} successfully reloaded.')
-                reload.append(f'{filename[:-3]} successfully reloaded.')
+                await bot.load_extension(f'cogs.{filename[:-3]}') # :-3 literally just strips the last three characters on the file name, which is .py
             except Exception as e:
-                print(f'Failed to reload {filename[:-3]}: {e}')
-                reload.append(f'Failed to reload {filename[:-3]}, check terminal.')
-    if reload:
-        message = '\n'.join(reload)
-    else:
-        message = 'No cogs found.'
-    await interaction.response.send_message(message, ephemeral=True)
+                print(f'Failed to load {filename[:-3]}: {e}')
 
-async def main():
-    await load()
+def main():
+    handler = logging.FileHandler(filename='discord.log', encoding='utf-8', mode='w')
+    bot = create_bot()
+    asyncio.run(load(bot))
+    print('Starting bot...')
+    token = os.getenv("BOT_TOKEN")
+    if not token:
+        raise ValueError("No token found in .env file.")
+    bot.run(token, log_handler=handler)
 
-asyncio.run(main())
-print('Starting bot...')
-token = os.getenv("BOT_TOKEN")
-if not token:
-    raise ValueError("No token found in .env file.")
-bot.run(token, log_handler=handler)
\ No newline at end of file
+if __name__ == '__main__':
+    main()
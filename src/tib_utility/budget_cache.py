@@ -0,0 +1,97 @@
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Hashable
+
+
+class BudgetCache:
+    """A dict-like LRU cache that evicts the least recently used entries once their total size goes over a byte budget.
+
+    Pinned keys are never evicted (but still count towards the size). Safe to use from several threads.
+    """
+    def __init__(self, name: str, budget: int, size_of: Callable[[Any], int]):
+        self.name = name
+        self.budget = budget
+        self.size_of = size_of
+        self.entries: OrderedDict[Hashable, Any] = OrderedDict()
+        self.sizes: dict[Hashable, int] = {}
+        self.pinned: set[Hashable] = set()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self.lock:
+            return key in self.entries
+
+    def __len__(self) -> int:
+        with self.lock:
+            return len(self.entries)
+
+    def __setitem__(self, key: Hashable, value: Any):
+        self.put(key, value)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Get an entry (marking it as recently used), counting hits & misses."""
+        with self.lock:
+            if key not in self.entries:
+                self.misses += 1
+                return default
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return self.entries[key]
+
+    def put(self, key: Hashable, value: Any):
+        """Add or replace an entry, then evict until the cache fits its budget again."""
+        with self.lock:
+            if key in self.entries:
+                self.size -= self.sizes.pop(key)
+                del self.entries[key]
+            self.entries[key] = value
+            self.sizes[key] = self.size_of(value)
+            self.size += self.sizes[key]
+            self.evict()
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        with self.lock:
+            if key not in self.entries:
+                return default
+            self.size -= self.sizes.pop(key)
+            return self.entries.pop(key)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.sizes.clear()
+            self.size = 0
+
+    def pin(self, keys):
+        """Never evict these keys (replaces any previous pins)."""
+        with self.lock:
+            self.pinned = set(keys)
+
+    def evict(self):
+        """Drop least recently used, unpinned entries until the size fits the budget. Call with the lock held."""
+        for key in list(self.entries):
+            if self.size <= self.budget:
+                break
+            if key in self.pinned:
+                continue
+            self.size -= self.sizes.pop(key)
+            del self.entries[key]
+            self.evictions += 1
+            print(f'{self.name}: evicted {key} ({self.size / 1024 / 1024:.1f}/{self.budget / 1024 / 1024:.1f}MiB used)')
+
+    def stats(self) -> dict:
+        """Size, budget, entry count and hit/miss/eviction counts."""
+        with self.lock:
+            return {
+                'size': self.size,
+                'budget': self.budget,
+                'entries': len(self.entries),
+                'pinned': len(self.pinned & set(self.entries)),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
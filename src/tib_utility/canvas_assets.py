@@ -0,0 +1,112 @@
+import os
+import threading
+from typing import Optional
+import numpy as np
+from PIL import Image
+import tib_utility.config as config
+from tib_utility.budget_cache import BudgetCache
+
+UNKNOWN = 255 # pixel colour isn't in the palette (or there's no palette index that fits in a uint8)
+CANVAS_KINDS = ('initial', 'final')
+
+canvas_lock = threading.Lock() # guards canvas_locks
+canvas_locks: dict[tuple[str, str], threading.Lock] = {} # per (canvas, kind), so decoding one canvas doesn't hold up the rest
+loaded_canvases = BudgetCache('Canvas cache', config.process_budget(config.canvas_cache_budget()), lambda indices: indices.nbytes)
+loaded_canvases.pin((canvas, kind) for canvas in config.pinned_canvases() for kind in CANVAS_KINDS)
+
+
+def palette_keys(palette: list[tuple[int, int, int]]) -> np.ndarray:
+    """Packed RGB per palette index, with an extra entry at the end (-1) that UNKNOWN pixels map to."""
+    keys = [(r << 16) | (g << 8) | b for r, g, b in palette]
+    return np.array(keys + [-1], dtype=np.int64)
+
+
+def canvas_key_lock(canvas: str, kind: str) -> threading.Lock:
+    with canvas_lock:
+        return canvas_locks.setdefault((canvas, kind), threading.Lock())
+
+
+def png_path(canvas: str, kind: str) -> str:
+    """Where pxlslog-explorer keeps the PNG for a canvas."""
+    ple_dir = config.pxlslog_explorer_dir
+    if kind == 'initial':
+        return f'{ple_dir}/pxls-canvas/canvas-{canvas}-initial.png'
+    return f'{ple_dir}/pxls-final-canvas/canvas-{canvas}-final.png'
+
+
+def npy_path(canvas: str, kind: str) -> str:
+    """Where the decoded palette indices for a canvas are stored (next to pxls-canvas/)."""
+    palette = config.get_palette(canvas)
+    return f'{config.pxlslog_explorer_dir}/pxls-canvas-index/canvas-{canvas}-{kind}-p{palette}.npy'
+
+
+def decode_canvas(path: str, palette: list[tuple[int, int, int]]) -> np.ndarray:
+    """Decode a canvas PNG into a (height, width) uint8 array of palette indices.
+
+    Args:
+        path (str): The PNG to decode.
+        palette (list[tuple[int, int, int]]): The canvas palette.
+
+    Returns:
+        np.ndarray: Palette index per pixel, UNKNOWN where the colour isn't in the palette.
+    """
+    with Image.open(path) as img:
+        rgb = np.asarray(img.convert('RGB')).astype(np.int64)
+    keys = (rgb[..., 0] << 16) | (rgb[..., 1] << 8) | rgb[..., 2]
+    colour_index = {}
+    for index, key in enumerate(palette_keys(palette)[:-1].tolist()):
+        if index < UNKNOWN:
+            colour_index.setdefault(key, index) # first index wins for duplicate colours
+    unique_keys, inverse = np.unique(keys, return_inverse=True)
+    unique_indices = np.array([colour_index.get(key, UNKNOWN) for key in unique_keys.tolist()], dtype=np.uint8)
+    return unique_indices[inverse.reshape(keys.shape)]
+
+
+def load_canvas(canvas: str, kind: str, palette: list[tuple[int, int, int]]) -> Optional[np.ndarray]:
+    """Get a canvas as palette indices, decoding the PNG only the first time.
+
+    The decoded array is written as a .npy file and memory-mapped from then on, so every code path
+    (and every restart) shares it. It's rebuilt if the PNG is newer than the .npy.
+
+    Args:
+        canvas (str): The canvas to load.
+        kind (str): 'initial' or 'final'.
+        palette (list[tuple[int, int, int]]): The canvas palette.
+
+    Returns:
+        Optional[np.ndarray]: Palette index per pixel (read-only), or None if the PNG doesn't exist.
+    """
+    if kind not in CANVAS_KINDS:
+        raise ValueError(f'Unknown canvas kind {kind}.')
+    with canvas_key_lock(canvas, kind):
+        indices = loaded_canvases.get((canvas, kind))
+        if indices is not None:
+            return indices
+        source = png_path(canvas, kind)
+        target = npy_path(canvas, kind)
+        try:
+            source_mtime = os.path.getmtime(source)
+        except FileNotFoundError:
+            print(f'No {kind} canvas found for c{canvas}.')
+            return None
+        if not os.path.exists(target) or os.path.getmtime(target) < source_mtime:
+            indices = decode_canvas(source, palette)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            temp_target = f'{target}.{os.getpid()}.tmp'
+            with open(temp_target, 'wb') as f:
+                np.save(f, indices)
+            os.replace(temp_target, target)
+            print(f'Decoded {kind} canvas for c{canvas} into {target}')
+        indices = np.load(target, mmap_mode='r')
+        loaded_canvases[(canvas, kind)] = indices
+        return indices
+
+
+def forget_canvas(canvas: Optional[str] = None):
+    """Drop loaded canvases (all of them if canvas is None), eg. after replacing a canvas PNG."""
+    if canvas is None:
+        loaded_canvases.clear()
+        return
+    for kind in CANVAS_KINDS:
+        with canvas_key_lock(canvas, kind):
+            loaded_canvases.pop((canvas, kind))
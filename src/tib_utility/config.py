@@ -1,4 +1,5 @@
 from dotenv import load_dotenv
+import multiprocessing
 import os
 load_dotenv()
 default_palette = 13 # REMINDER to change this
@@ -32,6 +33,100 @@ def dev_server():
         raise ValueError("DEV_SERVER_ID not set!")
     return int(dev_server_id)
 
+def template_workers():
+    """How many processes to load templates with on startup. Defaults to every core."""
+    workers = os.getenv("TEMPLATE_WORKERS")
+    if workers is None:
+        return os.cpu_count() or 1
+    return max(1, int(workers))
+
+def filter_engine():
+    """Which log filter to use: 'exe' (pxlslog-explorer's filter.exe, default) or 'python' (the in-process one in logfilter.py)."""
+    engine = os.getenv("FILTER_ENGINE", "exe").strip().lower()
+    if engine not in ("exe", "python"):
+        raise ValueError(f"Unknown FILTER_ENGINE {engine}!")
+    return engine
+
+def filter_workers():
+    """How many processes the in-process log filter uses. Defaults to every core."""
+    workers = os.getenv("FILTER_WORKERS")
+    if workers is None:
+        return os.cpu_count() or 1
+    return max(1, int(workers))
+
+def process_timeout(stage: str):
+    """Seconds filter.exe (FILTER_TIMEOUT, default 300) or render.exe (RENDER_TIMEOUT, default 180) may run before being killed."""
+    defaults = {"filter": 300, "render": 180}
+    return float(os.getenv(f"{stage.upper()}_TIMEOUT", defaults.get(stage, 300)))
+
+def process_limits():
+    """Optional CPU seconds (PROCESS_CPU_LIMIT) and memory (PROCESS_MEMORY_MB) limits for external processes, POSIX only."""
+    cpu_seconds = os.getenv("PROCESS_CPU_LIMIT")
+    memory_mb = os.getenv("PROCESS_MEMORY_MB")
+    return (int(cpu_seconds) if cpu_seconds else None,
+            int(float(memory_mb) * 1024 * 1024) if memory_mb else None)
+
+def worker_processes():
+    """How many worker processes do placemap analysis & native rendering (WORKER_PROCESSES, default 2).
+    0 runs them in threads inside the bot process instead."""
+    return max(0, int(os.getenv("WORKER_PROCESSES", 2)))
+
+def db_threads():
+    """How many threads run database queries, each with its own SQLite connection (DB_THREADS, default 4)."""
+    return max(1, int(os.getenv("DB_THREADS", 4)))
+
+def strict_query_plans():
+    """Whether the bot refuses to start when a hot query stops using its index (STRICT_QUERY_PLANS, default off)."""
+    return os.getenv("STRICT_QUERY_PLANS", "").strip().lower() in ("1", "true", "yes")
+
+def job_slots():
+    """How many placemap jobs can run at once (JOB_SLOTS, default 3)."""
+    return max(1, int(os.getenv("JOB_SLOTS", 3)))
+
+def jobs_per_user():
+    """How many of those slots a single user can take up (JOBS_PER_USER, default 1)."""
+    return max(1, int(os.getenv("JOBS_PER_USER", 1)))
+
+def stage_limits():
+    """How many jobs can be filtering (FILTER_SLOTS, default 2) or rendering (RENDER_SLOTS, default 3) at once."""
+    return {
+        "filter": max(1, int(os.getenv("FILTER_SLOTS", 2))),
+        "render": max(1, int(os.getenv("RENDER_SLOTS", 3))),
+    }
+
+def native_render_modes():
+    """Placemap modes rendered in-process instead of by render.exe (NATIVE_RENDER_MODES, comma separated, default none).
+    Only normal, activity, age and virgin can be rendered natively."""
+    modes = os.getenv("NATIVE_RENDER_MODES", "")
+    return {mode.strip().lower() for mode in modes.split(",") if mode.strip()}
+
+def render_cache_budget():
+    """How many bytes of rendered placemaps to keep in pxls-out-tib/cache (RENDER_CACHE_MB, default 2048)."""
+    return int(float(os.getenv("RENDER_CACHE_MB", 2048)) * 1024 * 1024)
+
+def template_cache_budget():
+    """How many bytes of compiled templates to keep in memory (TEMPLATE_CACHE_MB, default 512)."""
+    return int(float(os.getenv("TEMPLATE_CACHE_MB", 512)) * 1024 * 1024)
+
+def canvas_cache_budget():
+    """How many bytes of decoded canvases to keep mapped in memory (CANVAS_CACHE_MB, default 1024)."""
+    return int(float(os.getenv("CANVAS_CACHE_MB", 1024)) * 1024 * 1024)
+
+def leaderboard_cache_budget():
+    """How many bytes of rendered /list pages to keep in memory (LEADERBOARD_CACHE_MB, default 64)."""
+    return int(float(os.getenv("LEADERBOARD_CACHE_MB", 64)) * 1024 * 1024)
+
+def process_budget(budget: int):
+    """This process's share of a cache budget: worker processes split it between them, the bot's own process gets all of it."""
+    if multiprocessing.parent_process() is None:
+        return budget
+    return budget // max(1, worker_processes())
+
+def pinned_canvases():
+    """The newest TPE canvases (PINNED_CANVASES of them, default 3), which are never evicted from the template & canvas caches."""
+    count = int(os.getenv("PINNED_CANVASES", 3))
+    return tpe_canvas()[-count:] if count > 0 else []
+
 def get_palette(canvas: str):
     """A simple function to find the palette of a canvas. If it isn't found, apply a default palette."""
     match canvas:
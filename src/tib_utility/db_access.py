@@ -0,0 +1,286 @@
+import asyncio
+import functools
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Optional
+import tib_utility.config as config
+
+DB_PATH = Path(__file__).resolve().parents[1] / 'database.db'
+STATEMENT_CACHE = 256 # prepared statements each connection keeps around (sqlite3 caches them by query text)
+BUSY_TIMEOUT = 30.0 # seconds a connection waits for another process (eg. the GUI) to finish writing
+
+local = threading.local()
+connections: list[sqlite3.Connection] = []
+connections_lock = threading.Lock()
+write_lock = threading.Lock() # one writer at a time in this process, so the query threads don't fight over the WAL
+db_executor: Optional[ThreadPoolExecutor] = None
+
+# the queries behind the busiest commands, also checked against their query plans in migrations.check_query_plans
+USER_TOTAL = 'SELECT pixels FROM user_totals WHERE user = ?'
+USER_CANVAS_PIXELS = 'SELECT canvas, pixels FROM points WHERE user = ?'
+LEADERBOARD = 'SELECT user, pixels FROM user_totals ORDER BY pixels DESC, user'
+LEADERBOARD_PAGE = f'{LEADERBOARD} LIMIT ? OFFSET ?'
+CANVAS_LEADERBOARD_PAGE = 'SELECT user, pixels FROM points WHERE canvas=? ORDER BY pixels DESC, user LIMIT ? OFFSET ?'
+POINTS_VERSION = "(SELECT version FROM data_version WHERE name = 'points')"
+LEADERBOARD_SUMMARY = f'SELECT (SELECT COALESCE(SUM(pixels), 0) FROM canvas_totals), (SELECT COUNT(*) FROM user_totals), {POINTS_VERSION}'
+CANVAS_LEADERBOARD_SUMMARY = ('SELECT COALESCE((SELECT pixels FROM canvas_totals WHERE canvas=?), 0), '
+                              f'COALESCE((SELECT users FROM canvas_totals WHERE canvas=?), 0), {POINTS_VERSION}')
+CANVAS_TOTALS = 'SELECT canvas, pixels FROM canvas_totals'
+ACTIVE_USERS = 'SELECT COUNT(*) FROM user_totals'
+SET_PIXELS = 'INSERT INTO points VALUES (?, ?, ?) ON CONFLICT(user, canvas) DO UPDATE SET pixels = excluded.pixels'
+LOGKEY_CANVASES = 'SELECT canvas FROM logkey WHERE user = ? ORDER BY CAST(canvas AS INTEGER) DESC, canvas DESC'
+LINKED_USER = 'SELECT username FROM users WHERE user_id = ?'
+LINKED_DISCORD_ID = 'SELECT user_id FROM users WHERE username = ?'
+NOTIFICATION_USERS = 'SELECT user_id FROM users WHERE notif_status = 1'
+ALL_USERS = 'SELECT user_id, username FROM users'
+
+
+def connect() -> sqlite3.Connection:
+    """Open a new connection to the database with the usual pragmas."""
+    # only ever used by the thread that opened it, but shutdown() closes them all from the main thread
+    connection = sqlite3.connect(DB_PATH, timeout=BUSY_TIMEOUT, cached_statements=STATEMENT_CACHE, check_same_thread=False)
+    connection.execute('PRAGMA journal_mode=WAL;')
+    connection.execute('PRAGMA synchronous=NORMAL;')
+    connection.execute('PRAGMA temp_store=MEMORY;')
+    connection.execute('PRAGMA recursive_triggers=ON;') # so INSERT OR REPLACE into points fires the totals delete trigger
+    return connection
+
+
+def connection() -> sqlite3.Connection:
+    """This thread's connection, opened on first use."""
+    existing = getattr(local, 'connection', None)
+    if existing is None:
+        existing = local.connection = connect()
+        with connections_lock:
+            connections.append(existing)
+    return existing
+
+
+def get_db_executor() -> ThreadPoolExecutor:
+    """The threads queries run on, started on first use."""
+    global db_executor
+    if db_executor is None:
+        db_executor = ThreadPoolExecutor(max_workers=config.db_threads(), thread_name_prefix='tib-db')
+    return db_executor
+
+
+async def run(func: Callable, *args):
+    """Run a function using connection() on the database threads, so queries never block the event loop."""
+    return await asyncio.get_running_loop().run_in_executor(get_db_executor(), functools.partial(func, *args))
+
+
+def fetch_all(query: str, params: tuple = ()) -> list[tuple]:
+    return connection().execute(query, params).fetchall()
+
+
+def fetch_one(query: str, params: tuple = ()) -> Optional[tuple]:
+    return connection().execute(query, params).fetchone()
+
+
+def write(statements: list[tuple[str, tuple]]) -> list[int]:
+    """Run statements in one transaction, returning the number of rows each one changed."""
+    db = connection()
+    with write_lock, db:
+        return [db.execute(query, params).rowcount for query, params in statements]
+
+
+def write_many(query: str, rows: list[tuple]):
+    db = connection()
+    with write_lock, db:
+        db.executemany(query, rows)
+
+
+def shutdown():
+    """Stop the query threads, checkpoint the WAL and close every connection."""
+    global db_executor
+    if db_executor is not None:
+        db_executor.shutdown(wait=True)
+        db_executor = None
+    with connections_lock:
+        for db in connections:
+            db.close()
+        connections.clear()
+    db = connect()
+    try:
+        db.execute('PRAGMA wal_checkpoint(TRUNCATE);')
+    finally:
+        db.close()
+
+
+# users
+
+async def linked_pxls_username(user_id: int) -> Optional[str]:
+    row = await run(fetch_one, LINKED_USER, (user_id,))
+    return row[0] if row else None
+
+
+async def linked_discord_id(pxls_username: str) -> Optional[int]:
+    row = await run(fetch_one, LINKED_DISCORD_ID, (pxls_username,))
+    return row[0] if row else None
+
+
+async def all_users() -> list[tuple[int, str]]:
+    """Every (user_id, username) in the users table."""
+    return await run(fetch_all, ALL_USERS)
+
+
+async def linked_usernames() -> dict[int, str]:
+    """Discord user ID to Pxls username, for every linked user."""
+    return dict(await run(fetch_all, 'SELECT user_id, username FROM users WHERE username IS NOT NULL'))
+
+
+async def link_user(user_id: int, username: str):
+    """Link a Pxls username to a Discord user.
+
+    Raises:
+        sqlite3.IntegrityError: If the username is already linked to someone else.
+    """
+    await run(write, [('INSERT INTO users (user_id, username) VALUES (?, ?) ON CONFLICT(user_id) DO UPDATE SET username = ?',
+                       (user_id, username, username))])
+
+
+async def unlink_user(username: str) -> bool:
+    """Unlink a Pxls username, returning whether anyone had it linked."""
+    changed, = await run(write, [('UPDATE users SET username = NULL WHERE username = ?', (username,))])
+    return changed > 0
+
+
+async def notification_users() -> list[int]:
+    """Discord user IDs of everyone signed up for notifications."""
+    return [row[0] for row in await run(fetch_all, NOTIFICATION_USERS)]
+
+
+def toggle_notifications_sync(user_id: int) -> tuple[Optional[int], int]:
+    db = connection()
+    with write_lock, db:
+        db.execute('INSERT OR IGNORE INTO users (user_id) VALUES (?)', (user_id,))
+        row = db.execute('SELECT notif_status FROM users WHERE user_id = ?', (user_id,)).fetchone()
+        previous = row[0] if row else None
+        status = 0 if previous == 1 else 1
+        db.execute('UPDATE users SET notif_status = ? WHERE user_id = ?', (status, user_id))
+    return previous, status
+
+
+async def toggle_notifications(user_id: int) -> tuple[Optional[int], int]:
+    """Sign a user up for notifications, or unsubscribe them if they already were.
+
+    Returns:
+        tuple[Optional[int], int]: The previous notif_status (0 for a user that wasn't in the users table yet) and the new one.
+    """
+    return await run(toggle_notifications_sync, user_id)
+
+
+# points
+
+async def user_total(pxls_username: str) -> int:
+    row = await run(fetch_one, USER_TOTAL, (pxls_username,))
+    return row[0] if row else 0
+
+
+async def user_canvas_pixels(pxls_username: str) -> list[tuple[str, int]]:
+    """(canvas, pixels) for every canvas a user has placed on."""
+    return await run(fetch_all, USER_CANVAS_PIXELS, (pxls_username,))
+
+
+async def leaderboard() -> list[tuple[str, int]]:
+    """(user, pixels) for every user, most pixels first."""
+    return await run(fetch_all, LEADERBOARD)
+
+
+async def leaderboard_page(canvas: Optional[str], page_size: int, offset: int) -> list[tuple[str, int]]:
+    """One page of (user, pixels), most pixels first, either in total or on one canvas.
+
+    Args:
+        canvas (Optional[str]): The canvas, or None for the all-time leaderboard.
+        page_size (int): How many rows to get.
+        offset (int): How many rows to skip (rank - 1 of the first row).
+    """
+    if canvas:
+        return await run(fetch_all, CANVAS_LEADERBOARD_PAGE, (canvas, page_size, offset))
+    return await run(fetch_all, LEADERBOARD_PAGE, (page_size, offset))
+
+
+async def leaderboard_summary(canvas: Optional[str] = None) -> tuple[int, int, int]:
+    """Total pixels and number of users, either in total or on one canvas, and the version of points they're from.
+
+    The version goes up with every change to points, so anything computed from it (like a rendered page) can be cached by it.
+    """
+    if canvas:
+        return await run(fetch_one, CANVAS_LEADERBOARD_SUMMARY, (canvas, canvas))
+    return await run(fetch_one, LEADERBOARD_SUMMARY)
+
+
+async def canvas_totals() -> list[tuple[str, int]]:
+    """(canvas, pixels) summed over every user."""
+    return await run(fetch_all, CANVAS_TOTALS)
+
+
+async def active_user_count() -> int:
+    row = await run(fetch_one, ACTIVE_USERS)
+    return row[0]
+
+
+async def set_pixels(pxls_username: str, canvas: str, pixels: int):
+    await run(write, [(SET_PIXELS, (pxls_username, canvas, pixels))])
+
+
+# log keys
+
+async def logkey(user_id: int, canvas: str) -> Optional[str]:
+    row = await run(fetch_one, 'SELECT key FROM logkey WHERE canvas=? AND user=?', (canvas, user_id))
+    return row[0] if row else None
+
+
+async def logkey_canvases(user_id: int) -> list[str]:
+    """Canvases a user has added log keys for, newest first."""
+    rows = await run(fetch_all, LOGKEY_CANVASES, (user_id,))
+    return [str(row[0]) for row in rows]
+
+
+def save_logkey_sync(user_id: int, canvas: str, key: str):
+    write([
+        ('INSERT OR REPLACE INTO logkey VALUES (?, ?, ?)', (user_id, canvas, key)),
+        ('INSERT OR IGNORE INTO users (user_id) VALUES (?)', (user_id,)),
+        ('DELETE FROM filtered_log WHERE user=? AND canvas=?', (user_id, canvas)),
+    ])
+
+
+async def save_logkey(user_id: int, canvas: str, key: str):
+    """Store a user's log key for a canvas and make their next placemap filter again."""
+    await run(save_logkey_sync, user_id, canvas, key)
+
+
+# filtered logs & TPE stats (see db_utils)
+
+async def filtered_log_fingerprint(user_id: int, canvas: str) -> Optional[str]:
+    row = await run(fetch_one, 'SELECT fingerprint FROM filtered_log WHERE user=? AND canvas=?', (user_id, canvas))
+    return row[0] if row else None
+
+
+async def record_filtered_log(user_id: int, canvas: str, fingerprint: str):
+    await run(write, [('INSERT OR REPLACE INTO filtered_log VALUES (?, ?, ?)', (user_id, canvas, fingerprint))])
+
+
+async def forget_filtered_log(user_id: int, canvas: str):
+    await run(write, [('DELETE FROM filtered_log WHERE user=? AND canvas=?', (user_id, canvas))])
+
+
+async def stored_tpe_stats(user_id: Optional[int] = None, canvas: Optional[str] = None) -> list[tuple]:
+    """(user, canvas, log_fingerprint, template_fingerprint, total_pixels, undo, tpe_pixels, tpe_griefs) for a user or a canvas."""
+    query = 'SELECT user, canvas, log_fingerprint, template_fingerprint, total_pixels, undo, tpe_pixels, tpe_griefs FROM tpe_stats'
+    if user_id is not None:
+        return await run(fetch_all, f'{query} WHERE user=?', (user_id,))
+    return await run(fetch_all, f'{query} WHERE canvas=?', (canvas,))
+
+
+async def record_tpe_stats(rows: list[tuple]):
+    """Upsert tpe_stats rows, see db_utils.record_tpe_stats."""
+    await run(write_many,
+        'INSERT INTO tpe_stats VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT(user, canvas) DO UPDATE SET '
+        'log_fingerprint=excluded.log_fingerprint, template_fingerprint=excluded.template_fingerprint, '
+        'total_pixels=excluded.total_pixels, undo=excluded.undo, tpe_pixels=excluded.tpe_pixels, tpe_griefs=excluded.tpe_griefs, '
+        'survived=CASE WHEN excluded.survived IS NULL AND tpe_stats.log_fingerprint=excluded.log_fingerprint '
+        'THEN tpe_stats.survived ELSE excluded.survived END',
+        rows)
@@ -1,23 +1,34 @@
-import functools
-import sqlite3
 import asyncio
-import csv
 import os
 import re
 import io
 import time
+import hashlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 from typing import Union, Optional
 import discord
-from PIL import Image
 import tib_utility.config as config
+import tib_utility.db_access as db_access
+import tib_utility.migrations as migrations
+import tib_utility.userlog as userlog
+import tib_utility.templates as templates
+import tib_utility.canvas_assets as canvas_assets
+import tib_utility.logfilter as logfilter
+import tib_utility.scheduler as scheduler
+import tib_utility.render_cache as render_cache
+import tib_utility.placemap_render as placemap_render
+import tib_utility.workers as workers
+import tib_utility.worker_jobs as worker_jobs
+import tib_utility.processes as processes
+from tib_utility.budget_cache import BudgetCache
+import numpy as np
 from functools import lru_cache
 from pathlib import Path
-from collections import Counter
 import matplotlib
 matplotlib.use('agg')
 import matplotlib.pyplot as plt
 from matplotlib.ticker import StrMethodFormatter
-import glob
 
 CANVAS_REGEX = re.compile(r'^(?![cC])[a-z0-9]{1,4}$')
 KEY_REGEX = re.compile(r'(?=.*[a-z])[a-z0-9]{512}$')
@@ -26,49 +37,98 @@ USERNAME_REGEX = re.compile(r'^[a-zA-Z0-9_-]{1,32}$')
 CUR_DIR = Path(__file__).resolve()
 SRC_DIR = CUR_DIR.parents[1]
 ROOT_DIR = CUR_DIR.parents[2]
-DB_PATH = SRC_DIR / 'database.db'
-
-database = sqlite3.connect(DB_PATH, check_same_thread=False)
-cursor = database.cursor()
-cursor.execute('PRAGMA journal_mode=WAL;')
-cursor.execute('PRAGMA synchronous=NORMAL;')
-cursor.execute('PRAGMA temp_store=MEMORY;')
-database.execute('CREATE TABLE IF NOT EXISTS points(user STR, canvas STR, pixels INT, PRIMARY KEY (user, canvas))')
-database.execute('CREATE TABLE IF NOT EXISTS users (user_id INT, username STR UNIQUE, notif_status BOOLEAN DEFAULT 0, PRIMARY KEY (user_id))')
-database.execute('CREATE TABLE IF NOT EXISTS logkey(user INT, canvas STR, key STR, PRIMARY KEY (user, canvas))')
-
-semaphore = asyncio.Semaphore(3)
-global_template_map = {}
-global_initial_canvas = {}
-global_template_cache = {}
+DB_PATH = db_access.DB_PATH
+TEMPLATE_CACHE_DIR = ROOT_DIR / 'template' / '.cache'
+
+schema = db_access.connect()
+migrations.migrate(schema)
+query_plan_problems = migrations.check_query_plans(schema) # shown in /admin template-status
+totals_problems = migrations.check_totals(schema) # eg. a script replaced rows in points over a plain connection
+for problem in totals_problems:
+    print(f'Totals check failed: {problem}')
+if totals_problems:
+    migrations.rebuild_totals(schema)
+    print('Rebuilt user_totals and canvas_totals from points.')
+schema.close()
+for problem in query_plan_problems:
+    print(f'Query plan check failed: {problem}')
+if query_plan_problems and config.strict_query_plans():
+    raise RuntimeError(f'{len(query_plan_problems)} hot queries don\'t use their indexes (STRICT_QUERY_PLANS is on).')
+
+job_scheduler = scheduler.JobScheduler(config.job_slots(), config.jobs_per_user(), config.stage_limits())
+placemap_flights = scheduler.SingleFlight() # keyed by (user_id, canvas, mode), so duplicate requests share one run
+template_flights = scheduler.SingleFlight() # keyed by canvas, so a canvas's templates are only loaded once at a time
+PRERENDER_MODES = ('activity', 'age') # rendered in the background after a normal placemap, see PlacemapAltView.prerender
+global_template_map = BudgetCache('Template cache', config.template_cache_budget(),
+                                  lambda template: template.nbytes if template is not None else 0)
+global_template_map.pin(config.pinned_canvases())
+template_ready: dict[str, asyncio.Future] = {} # canvases queued by preload_canvas_cache, done once loaded
+template_pending: list[str] = [] # queued canvases nobody has started loading yet, in priority order
+template_timings: dict[str, dict] = {}
+template_warmup: dict[str, Optional[float]] = {'started': None, 'finished': None}
+filter_pool: Optional[ProcessPoolExecutor] = None
 
 
 def db_shutdown():
+    if filter_pool is not None:
+        filter_pool.shutdown(cancel_futures=True)
+    workers.shutdown()
     try:
-        cursor.execute("PRAGMA wal_checkpoint(TRUNCATE);")
-        database.commit()
-        database.close()
+        db_access.shutdown()
         print('DB synced. Goodbye')
     except Exception as e:
         print(f'Error during DB shutdown: {e}')
 
 
-async def preload_canvas_cache(canvases: Optional[list[str]] = None):
+async def preload_canvas_cache(canvases: Optional[list[str]] = None, worker_count: Optional[int] = None):
+    """Load the templates for every TPE canvas over a process pool, newest canvases first.
+
+    Args:
+        canvases (Optional[list[str]]): The canvases to load, in order of priority. Defaults to config.tpe_canvas(), newest first.
+        worker_count (Optional[int]): How many processes to use. Defaults to config.template_workers().
+    """
     if canvases is None:
-        canvases = config.tpe_canvas()
-    start = time.time()
+        canvases = list(reversed(config.tpe_canvas())) # the newest canvases are the ones people actually generate for
+    if worker_count is None:
+        worker_count = config.template_workers()
+    loop = asyncio.get_running_loop()
     for canvas in canvases:
-        await asyncio.to_thread(create_template_cache, canvas)
+        if canvas not in global_template_map and canvas not in template_ready:
+            template_ready[canvas] = loop.create_future()
+            template_pending.append(canvas)
+    template_warmup['started'] = time.time()
+    template_warmup['finished'] = None
+    start = time.time()
+    # not a `with` block, its exit would wait for the workers to stop on the event loop thread
+    pool = ProcessPoolExecutor(max_workers=worker_count, mp_context=multiprocessing.get_context('spawn'))
+
+    async def preload_worker():
+        while template_pending:
+            canvas = template_pending.pop(0)
+            loading_time_begin = time.time()
+            try:
+                build_args = await asyncio.to_thread(template_build_args, canvas) # lists the template dir & reads the palette
+                if not build_args[1]: # no templates, no point in bothering a worker
+                    template, source = None, 'empty'
+                else:
+                    template, source = await loop.run_in_executor(pool, templates.build_raster, *build_args)
+            except Exception as e:
+                print(f'Failed to preload templates for c{canvas}: {e}')
+                template, source = None, 'failed'
+            finish_template_load(canvas, template, source, time.time() - loading_time_begin)
+
+    try:
+        await asyncio.gather(*(preload_worker() for _ in range(worker_count)))
+    finally:
+        await asyncio.to_thread(pool.shutdown)
     end = time.time()
-    print(f"Total template loading time: {end - start:.3f}s")
+    template_warmup['finished'] = end
+    print(f"Total template loading time: {end - start:.3f}s ({worker_count} workers)")
 
 
 async def get_linked_pxls_username(user_id: int):
     """Get the linked Pxls username for a given Discord user ID."""
-    query = "SELECT username FROM users WHERE user_id = ?"
-    cursor.execute(query, (user_id,))
-    result = cursor.fetchone()
-    return result[0] if result else None
+    return await db_access.linked_pxls_username(user_id)
 
 
 async def get_linked_discord_username(pxls_username: str):
@@ -80,10 +140,7 @@ async def get_linked_discord_username(pxls_username: str):
     Returns:
         int | None: The linked Discord user ID, or None if not found.
     """
-    query = "SELECT user_id FROM users WHERE username = ?"
-    cursor.execute(query, (pxls_username,))
-    result = cursor.fetchone()
-    return result[0] if result else None
+    return await db_access.linked_discord_id(pxls_username)
 
 
 async def resolve_name(identifier: str) -> int | None:
@@ -103,7 +160,7 @@ async def resolve_name(identifier: str) -> int | None:
     return None
 
 
-def get_stats(pxls_username: str) -> dict:
+async def get_stats(pxls_username: str) -> dict:
     """Find userstats by quering the DB.
 
     Args:
@@ -112,9 +169,7 @@ def get_stats(pxls_username: str) -> dict:
     Returns:
         dict: The user's stats (total pixels, rank, and group).
     """
-    query = "SELECT SUM(pixels) FROM points WHERE user = ?"
-    cursor.execute(query, (pxls_username,))
-    total = cursor.fetchone()[0] or 0
+    total = await db_access.user_total(pxls_username)
     rank = "nothing"
     group = "nothing"
     if total is None:
@@ -134,25 +189,25 @@ def get_stats(pxls_username: str) -> dict:
     return {'total': total, 'rank': rank, 'group': group}
 
 
-def get_all_users() -> list[tuple[int, str]]:
+async def get_all_users() -> list[tuple[int, str]]:
     """Get all linked Discord user IDs."""
-    query = "SELECT user_id, username FROM users"
-    cursor.execute(query)
-    results = cursor.fetchall()
-    return results
+    return await db_access.all_users()
 
 
 async def filter(canvas: str, user_key: str, logfile: str, user_log_file: str, user: Optional[str] = None) -> bool:
+    if config.filter_engine() == 'python':
+        print(f'Filtering {user_key} for {user if user else "<unknown>"} on canvas {canvas} (in-process).')
+        return (await filter_in_process(canvas, {user_key: user_log_file}, logfile))[user_key]
+    return await filter_exe(canvas, user_key, logfile, user_log_file, user)
+
+
+async def filter_exe(canvas: str, user_key: str, logfile: str, user_log_file: str, user: Optional[str] = None) -> bool:
+    """Filter the sanit log for one log key with pxlslog-explorer's filter.exe."""
     ple_dir = config.pxlslog_explorer_dir
     filter_cli = [f'{ple_dir}/filter.exe', '--user', user_key, '--log', logfile,
                 '--output', user_log_file]
-    filter_result = await asyncio.create_subprocess_exec(
-        *filter_cli, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
-    )
     print(f'Filtering {user_key} for {user if user else "<unknown>"} on canvas {canvas}.')
-    stdout, stderr = await filter_result.communicate()
-    stdout_str = stdout.decode('utf-8').strip()
-    stderr_str = stderr.decode('utf-8').strip()
+    filter_result, stdout_str, stderr_str = await processes.run_process(filter_cli, 'filter')
     print(f'Subprocess output: {stdout_str}')
     print(f'Subprocess error: {stderr_str}')
     if filter_result.returncode != 0:
@@ -171,9 +226,126 @@ async def filter(canvas: str, user_key: str, logfile: str, user_log_file: str, u
     return True
 
 
+def filter_fingerprint(user_key: str, logfile: str) -> str:
+    """Identify a filter run by the log key and the size & modification time of the sanit log it read."""
+    log_stat = os.stat(logfile)
+    key_hash = hashlib.sha256(user_key.encode()).hexdigest()
+    return f'{key_hash}:{log_stat.st_size}:{log_stat.st_mtime_ns}'
+
+
+async def filtered_log_is_current(user_id: int, canvas: str, fingerprint: str, user_log_file: str) -> bool:
+    """Whether user_log_file was filtered from the same key & sanit log as fingerprint describes, so filtering again can be skipped."""
+    if await db_access.filtered_log_fingerprint(user_id, canvas) != fingerprint:
+        return False
+    try:
+        return os.path.getsize(user_log_file) > 0
+    except OSError:
+        return False
+
+
+async def record_filtered_log(user_id: int, canvas: str, fingerprint: str):
+    await db_access.record_filtered_log(user_id, canvas, fingerprint)
+
+
+async def forget_filtered_log(user_id: int, canvas: str):
+    """Make the next placemap for this user & canvas filter again, eg. after their log key was replaced."""
+    await db_access.forget_filtered_log(user_id, canvas)
+
+
+def log_fingerprint(user_log_file: str) -> str:
+    """Identify a filtered user log by its size & modification time."""
+    log_stat = os.stat(user_log_file)
+    return f'{log_stat.st_size}:{log_stat.st_mtime_ns}'
+
+
+def template_set_fingerprint(canvas: str) -> str:
+    """Identify the saved templates of a canvas (plus its initial canvas & palette) by their size & modification time.
+
+    Cheap enough to check every stored TPE stat against, unlike templates.template_fingerprint which hashes the images.
+    """
+    palette_path, initial_canvas_path = config.palette_initial_paths(canvas)
+    parts = []
+    for path in [palette_path, initial_canvas_path, *saved_template_paths(canvas)]:
+        try:
+            path_stat = os.stat(path)
+            parts.append(f'{os.path.basename(path)}:{path_stat.st_size}:{path_stat.st_mtime_ns}')
+        except OSError:
+            parts.append(f'{os.path.basename(path)}:missing')
+    return hashlib.sha256('\n'.join(parts).encode()).hexdigest()
+
+
+async def stored_tpe_stats(user_id: Optional[int] = None, canvas: Optional[str] = None) -> dict[tuple[int, str], tuple]:
+    """Stored TPE stats for a user (on every canvas) or a canvas (for every user).
+
+    Returns:
+        dict[tuple[int, str], tuple]: (user, canvas) to (log_fingerprint, template_fingerprint, total_pixels, undo, tpe_pixels, tpe_griefs).
+    """
+    rows = await db_access.stored_tpe_stats(user_id=user_id, canvas=canvas)
+    return {(int(row[0]), str(row[1])): row[2:] for row in rows}
+
+
+async def record_tpe_stats(rows: list[tuple]):
+    """Store TPE stats, rows being (user, canvas, log_fingerprint, template_fingerprint, total_pixels, undo, tpe_pixels, tpe_griefs, survived).
+
+    A survived of None keeps the stored one as long as the user log didn't change (only placemaps count surviving pixels).
+    """
+    await db_access.record_tpe_stats(rows)
+
+
+def get_filter_pool() -> Optional[ProcessPoolExecutor]:
+    """The process pool the in-process log filter splits sanit logs over, started on first use (None with 1 worker)."""
+    global filter_pool
+    processes_count = config.filter_workers()
+    if filter_pool is None and processes_count > 1:
+        filter_pool = ProcessPoolExecutor(max_workers=processes_count, mp_context=multiprocessing.get_context('spawn'))
+    return filter_pool
+
+
+async def filter_many(canvas: str, outputs: dict[str, str], logfile: str) -> dict[str, bool]:
+    """Filter the sanit log for several log keys at once, with the engine config.filter_engine() picks (like filter()).
+
+    The in-process filter reads the sanit log only one time for all of them, filter.exe runs once per key
+    (up to config.filter_workers() at a time).
+
+    Args:
+        canvas (str): The canvas the log is for.
+        outputs (dict[str, str]): Log key to the filepath its filtered user log should be written to.
+        logfile (str): The sanit log to filter.
+
+    Returns:
+        dict[str, bool]: Log key to whether anything was found for it (same as filter()).
+    """
+    if config.filter_engine() == 'python':
+        return await filter_in_process(canvas, outputs, logfile)
+    limiter = asyncio.Semaphore(config.filter_workers())
+
+    async def filter_one(user_key: str, user_log_file: str) -> bool:
+        async with limiter:
+            return await filter_exe(canvas, user_key, logfile, user_log_file)
+
+    results = await asyncio.gather(*(filter_one(key, path) for key, path in outputs.items()))
+    return dict(zip(outputs, results))
+
+
+async def filter_in_process(canvas: str, outputs: dict[str, str], logfile: str) -> dict[str, bool]:
+    """Filter the sanit log for several log keys in one pass with logfilter (split over get_filter_pool())."""
+    print(f'Filtering {len(outputs)} keys on canvas {canvas} in one pass.')
+    try:
+        counts = await asyncio.to_thread(logfilter.filter_keys, logfile, outputs, get_filter_pool())
+    except Exception as e:
+        print(f'Batch filtering failed on canvas {canvas}: {e}')
+        return {key: False for key in outputs}
+    for key, count in counts.items():
+        if count == 0:
+            print(f'Filtered log file is empty for {outputs[key]} on canvas {canvas}.')
+    return {key: count > 0 for key, count in counts.items()}
+
+
 async def render(user: Union[discord.User, discord.Member], canvas: str, mode: str, user_log_file: str) -> tuple[
-    asyncio.subprocess.Process, str, str]:
-    """Render pipeline to make placemaps using filtered user log keys using Etos2's pxlslog-explorer.
+    Union[asyncio.subprocess.Process, render_cache.FinishedRender], str, Union[str, bytes]]:
+    """Render pipeline to make placemaps using filtered user log keys, served from the render cache when possible.
+
+    Modes in config.native_render_modes() are rendered in-process (see placemap_render), the rest by Etos2's pxlslog-explorer.
 
     Args:
         user (Union[discord.User, discord.Member]): For Discord user ID.
@@ -181,21 +353,65 @@ async def render(user: Union[discord.User, discord.Member], canvas: str, mode: s
         mode (str): The mode to render in. Defaults to normal, and can be virgin, activity, age, milliseconds, minutes, seconds, or combined.
         user_log_file (str): The filepath to the filtered user log file in question.
 
+    Returns:
+        tuple[Union[asyncio.subprocess.Process, render_cache.FinishedRender], str, Union[str, bytes]]: The process (a
+            FinishedRender if render.exe didn't run), filename, and the output path or, for native renders, the PNG itself.
+            Use placemap_file() to turn the output into a discord.File.
+    """
+    bg, palette_path, _ = config.paths(canvas, user.id, mode)
+    filename = f'c{canvas}_{mode}_{user.id}.png'
+    native = mode in config.native_render_modes() and mode in placemap_render.NATIVE_MODES
+    cache_key = await asyncio.to_thread(render_cache.render_key, user_log_file, mode, palette_path, bg, native)
+    cached_path = await asyncio.to_thread(render_cache.lookup, cache_key)
+    if cached_path:
+        print(f'Using cached {mode} placemap for {user} on canvas {canvas} (cache hit)')
+        return render_cache.FinishedRender(), filename, cached_path
+    if native:
+        render_start_time = time.time()
+        try:
+            data = await render_native(user_log_file, mode, palette_path, bg)
+        except Exception as e:
+            print(f'Native {mode} render failed, falling back to render.exe: {e}')
+            cache_key = await asyncio.to_thread(render_cache.render_key, user_log_file, mode, palette_path, bg, False)
+            cached_path = await asyncio.to_thread(render_cache.lookup, cache_key, False) # the miss was counted above
+            if cached_path:
+                print(f'Using cached render.exe {mode} placemap for {user} on canvas {canvas} (cache hit)')
+                return render_cache.FinishedRender(), filename, cached_path
+        else:
+            print(f'Rendered {mode} placemap for {user} on canvas {canvas} in-process in {time.time() - render_start_time:.2f}s')
+            try:
+                await asyncio.to_thread(render_cache.store_bytes, cache_key, data)
+            except OSError as e:
+                print(f'Failed to cache the {mode} placemap: {e}')
+            return render_cache.FinishedRender(), filename, data
+    render_result, filename, output_path = await render_exe(user, canvas, mode, user_log_file)
+    if render_result.returncode == 0:
+        try:
+            await asyncio.to_thread(render_cache.store, cache_key, output_path)
+        except OSError as e:
+            print(f'Failed to cache the {mode} placemap: {e}')
+    return render_result, filename, output_path
+
+
+async def render_exe(user: Union[discord.User, discord.Member], canvas: str, mode: str, user_log_file: str,
+                     output_path: Optional[str] = None) -> tuple[asyncio.subprocess.Process, str, str]:
+    """Render a placemap with Etos2's pxlslog-explorer (render.exe), skipping the render cache.
+
+    Args:
+        output_path (Optional[str]): Where to write the PNG. Defaults to the user's usual output path (config.paths),
+            which only runs in placemap_flights should write to.
+
     Returns:
         tuple[asyncio.subprocess.Process, str, str]: The process, filename, and output path.
     """
-    bg, palette_path, output_path = config.paths(canvas, user.id, mode)
+    bg, palette_path, default_output_path = config.paths(canvas, user.id, mode)
+    output_path = output_path or default_output_path
     ple_dir = config.pxlslog_explorer_dir
     render_cli = [f'{ple_dir}/render.exe', '--log', user_log_file, '--bg', bg, '--palette', palette_path,
                   '--screenshot', '--output', output_path, mode]
     # render_result = subprocess.run(render_cli, capture_output=True, text=True) # use for error handling
-    render_result = await asyncio.create_subprocess_exec(
-        *render_cli, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
-    )
     print(f'Generating {mode} placemap for {user} on canvas {canvas}')
-    stdout, stderr = await render_result.communicate()
-    stdout_str = stdout.decode('utf-8').strip()
-    stderr_str = stderr.decode('utf-8').strip()
+    render_result, stdout_str, stderr_str = await processes.run_process(render_cli, 'render')
     print(f'Subprocess output: {stdout_str}')
     print(f'Subprocess error: {stderr_str}')
     # print(f'Final command list: {render_cli}') # use for error handling
@@ -203,6 +419,19 @@ async def render(user: Union[discord.User, discord.Member], canvas: str, mode: s
     return render_result, filename, output_path
 
 
+async def render_native(user_log_file: str, mode: str, palette_path: str, bg: str) -> bytes:
+    """Render a placemap without render.exe (in a worker process), returning the PNG."""
+    palette = await gpl_palette(palette_path)
+    return await workers.run(worker_jobs.render_native, user_log_file, mode, palette, bg)
+
+
+def placemap_file(output: Union[str, bytes], filename: str) -> discord.File:
+    """A discord.File for render()'s output, which is either a path or the PNG itself."""
+    if isinstance(output, bytes):
+        return discord.File(io.BytesIO(output), filename=filename)
+    return discord.File(output, filename=filename)
+
+
 async def gpl_palette(palette_path: str) -> list[tuple[int, int, int]]:
     return await asyncio.to_thread(read_gpl_palette, palette_path)
 
@@ -228,289 +457,198 @@ def read_gpl_palette(palette_path: str):
 
 # Placemap handling
 
-async def most_active(user_log_file: str) -> tuple[tuple[int, int], int]:
-    """Asyncio function to find most active pixel and how many pixels were placed there.
+async def analyze_user_log(user_log_file: str, canvas: Optional[str] = None, template: Optional[templates.TemplateRaster] = None) -> dict:
+    """Asyncio function to read a user log once and find every stat needed for a placemap.
 
     Args:
         user_log_file (str): Filepath to a user log file.
+        canvas (Optional[str]): The canvas to count TPE pixels for. If None (and no template), TPE counting is skipped.
+        template (Optional[templates.TemplateRaster]): Precompiled templates (eg. from user uploaded templates). Defaults to the cached ones for canvas.
 
     Returns:
-        tuple[tuple[int, int], int]: The most active coordinates and the number of times they were active.
+        dict: The stats found by userlog.read_user_log, ready for description_format.
     """
-    return await asyncio.to_thread(read_most_active, user_log_file)
+    if template is None and canvas is not None:
+        template = await get_template_raster(canvas)
+        if template is not None and config.worker_processes() > 0:
+            try: # workers read the raster from the template cache themselves (once each)
+                return await workers.run(worker_jobs.read_user_log_cached, user_log_file, template_cache_path(canvas))
+            except FileNotFoundError:
+                pass
+    return await workers.run(userlog.read_user_log, user_log_file, template)
 
 
-def read_most_active(user_log_file: str):
-    """Find most active pixel and how many pixels were placed there.
+def load_canvas_indices(canvas: str, kind: str) -> Optional[np.ndarray]:
+    """Get the initial or final canvas as palette indices from the canvas asset store.
 
     Args:
-        user_log_file (str): Filepath to a user log file.
+        canvas (str): The canvas to load.
+        kind (str): 'initial' or 'final'.
 
     Returns:
-        Tuple: The most active coordinates and the number of times they were active.
+        Optional[np.ndarray]: Palette index per pixel, or None if the canvas or its palette is missing.
     """
-    coords = []
-    with open(user_log_file, 'r', encoding='utf-8') as f:
-        for line in f:
-            parts = line.split('\t')
-            if len(parts) >= 6:
-                coords.append((parts[2].strip(), parts[3].strip()))
-    if not coords:
-        return (0, 0), 0
-    (found_most_active, count), = Counter(coords).most_common(1)
-    return found_most_active, count
+    palette_path, _ = config.palette_initial_paths(canvas)
+    try:
+        palette = read_gpl_palette(palette_path)
+    except FileNotFoundError as e:
+        print(f'{e}')
+        return None
+    if not palette:
+        print(f'Empty palette for c{canvas}.')
+        return None
+    return canvas_assets.load_canvas(canvas, kind, palette)
 
 
-async def pixel_counting(user_log_file: str):
-    """_summary_
+async def survival(final_state: tuple[np.ndarray, np.ndarray, np.ndarray], canvas: str) -> tuple[int, int]:
+    """Find survival stats on a canvas.
 
     Args:
-        user_log_file (str): Filepath to a user log file.
+        final_state (tuple[np.ndarray, np.ndarray, np.ndarray]): x, y and palette index of the user's final placement per pixel (see userlog.read_user_log).
+        canvas (str): The canvas to compare against.
 
     Returns:
-        Tuple: The total number of pixels placed (place - und), the number of undo actions, and the number of mod actions.
+        tuple[int, int]: The number of pixels replaced by other users, and the number of pixels that survived.
     """
-    return await asyncio.to_thread(read_pixel_counting, user_log_file)
+    palette_path, _ = config.palette_initial_paths(canvas)
+    palette = await gpl_palette(palette_path)
+    return await workers.run(worker_jobs.survival_counts, final_state, canvas, palette)
 
 
-def read_pixel_counting(user_log_file: str):
-    """_summary_
+def compile_template_raster(canvas: str, template_paths: list) -> Optional[templates.TemplateRaster]:
+    """Load templates & the initial canvas for a canvas and compile them into a TemplateRaster.
 
     Args:
-        user_log_file (str): Filepath to a user log file.
+        canvas (str): The canvas the templates are for.
+        template_paths (list): Paths to the template images.
 
     Returns:
-        Tuple: The total number of pixels placed (place - und), the number of undo actions, and the number of mod actions.
+        Optional[templates.TemplateRaster]: The compiled templates, or None if there are none (or something is missing).
     """
-    with open(user_log_file, 'r') as log_key:
-        data = log_key.read()
-    place = data.count('user place')
-    undo = data.count('undo')
-    mod = data.count('mod')
-    total_pixels = place - undo
-    return total_pixels, undo, mod
-
-
-async def survival(user_log_file: str, final_canvas_path: str, palette: list[tuple[int, int, int]]):
-    """Find survival stats on a canvas"""
-
-    def process_stats():
-        """Small function to parse a log file and find how many pixels survived, how many were replaced by other users, and how many were replaced by the user themselves.
-
-        Returns:
-            _type_: The number of pixels that survived, the number of pixels that were replaced by other users, and the number of pixels that were replaced by the user themselves.
-        """
-        final_state = {}
-        replaced_user = 0  # UNUSED
-        try:
-            with open(user_log_file, newline='') as csvfile:
-                reader = csv.reader(csvfile, delimiter='\t')
-                for row in reader:
-                    if len(row) >= 6:
-                        x, y, index, action = int(row[2].strip()), int(row[3].strip()), int(row[4].strip()), row[
-                            5].strip()
-                        coord = (x, y)
-                        if action == 'user place':
-                            if (x, y) in final_state:
-                                replaced_user += 1
-                            final_state[coord] = index
-                        elif action == 'user undo':
-                            final_state.pop(coord, None)
-        except FileNotFoundError as e:
-            print(f'{e}')
-            return 0, 0, 0
-
-        replaced_other = 0  # UNUSED
-        survived = 0
-        try:
-            with Image.open(final_canvas_path).convert('RGB') as final_canvas_image:
-                width, height = final_canvas_image.size
-                final_canvas_data = final_canvas_image.load()
-                if final_canvas_data is None:
-                    print('Failed to load final canvas image.')
-                    return 0, 0, 0
-                for coord, index in final_state.items():
-                    x, y = coord
-                    if x >= width or y >= height:
-                        continue
-                    if index >= len(palette):
-                        continue
-                    placed_pixel = palette[index]
-                    final_pixel = final_canvas_data[coord]
-                    if final_pixel == placed_pixel:
-                        survived += 1
-                    else:
-                        replaced_other += 1
-        except FileNotFoundError as e:
-            print(f'{e}')
-            return 0, 0, 0
-        return replaced_user, replaced_other, survived
-
-    return await asyncio.to_thread(process_stats)
-
-
-def create_template_cache(canvas: str):
-     if canvas not in global_template_map:
-        loading_time_begin = time.time()
-        template_map = []
-        try:
-            initial_canvas_image = Image.open(f'{config.pxlslog_explorer_dir}/pxls-canvas/canvas-{canvas}-initial.png').convert('RGB')
-            initial_canvas = initial_canvas_image.load()
-            if initial_canvas is None:
-                print('Failed to load initial canvas image.')
-                return 0, 0
-            template_dir = os.path.join(ROOT_DIR, 'template', f'c{canvas}')
-            if os.path.isdir(template_dir):
-                with os.scandir(template_dir) as entries:
-                    for entry in entries:
-                        if not entry.is_file():
-                            continue
-                        if not entry.name.lower().endswith('.png'):
-                            continue
-                        path = os.path.join(template_dir, entry.name)
-                        try:
-                            with Image.open(path).convert('RGBA') as img:
-                                bbox = img.getbbox()
-                                if bbox:
-                                    cropped_img = img.crop(bbox)
-                                    template_map.append({
-                                        'img': cropped_img,
-                                        'pixels': cropped_img.load(),
-                                        'bbox': bbox
-                                    })
-                        except Exception as e:
-                            print(f'Error loading template image {path}: {e}')
-        except FileNotFoundError as e:
-            print(f'{e}')
-            return 0, 0
-        loading_time_stop = time.time()
-        print(f'c{canvas} template loading took {loading_time_stop - loading_time_begin:.3f}s')
-        global_template_map[canvas] = template_map
-        global_initial_canvas[canvas] = initial_canvas
-        global_template_cache[canvas] = {}
-
-
-async def tpe_pixels_count(user_log_file: str, temp_pattern: str, palette_path: str, initial_canvas_path, logkey_check_from_user: bool = False, template_from_user: Optional[list[str]] = None) -> tuple[
-    int, int]:
-    """Function to find amount of TPE pixels for any given canvas, and for any given user.
+    initial_canvas = load_canvas_indices(canvas, 'initial')
+    if initial_canvas is None:
+        return None
+    palette_path, _ = config.palette_initial_paths(canvas)
+    palette = read_gpl_palette(palette_path)
+    try:
+        return templates.compile_templates(templates.load_template_images(template_paths), initial_canvas, palette)
+    except ValueError as e:
+        print(f'Failed to compile templates for c{canvas}: {e}')
+        return None
+
+
+async def get_template_raster(canvas: str, template_from_user: Optional[list] = None) -> Optional[templates.TemplateRaster]:
+    """Get the compiled templates for a canvas, either from the template cache or from user uploaded templates.
+
+    If the canvas is still queued for preloading it jumps the queue and is loaded right away, and if it's being preloaded
+    right now this waits for that instead of loading it twice.
 
     Args:
-        user_log_file (str): The user log file to parse.
-        temp_pattern (str): The template pattern to use. Defaults to "./template/c{canvas}/*.png".
-        palette_path (str): The path to the palette file.
-        initial_canvas_path (_type_): The path to the initial canvas image.
-        logkey_check_from_user (bool): If True, skips the cache process since this command call comes from regular users using their OWN temp pattern. If False, use the saved ones (see temp_pattern).
-        template_from_user (Optional[list[str]]): A list of paths to template images uploaded by the user.
+        canvas (str): The canvas to use.
+        template_from_user (Optional[list]): A list of paths to template images uploaded by the user. If None, use the saved ones.
+
     Returns:
-        tuple[int, int]: Correct pixels (tpe_place - tpe_grief) and grief pixels (tpe_grief).
+        Optional[templates.TemplateRaster]: The compiled templates, or None if there are no templates or no initial canvas.
     """
-    canvas = os.path.basename(initial_canvas_path).split('-')[1]
-    palette_rgb = [tuple(c) for c in await gpl_palette(palette_path)]
-    if not palette_rgb:
-        return 0, 0
-    
-    if logkey_check_from_user:
-        template_map = []
-        with Image.open(initial_canvas_path).convert('RGB') as initial_canvas_image:
-            initial_canvas = initial_canvas_image.load()
-            if initial_canvas is None:
-                print('Failed to load initial canvas image.')
-                return 0, 0
-        if template_from_user is not None:
-            user_template_files = template_from_user
-        else:
-            user_template_files = glob.glob(temp_pattern)
-        for path in user_template_files:
-            try:
-                with Image.open(path).convert('RGBA') as img:
-                    bbox = img.getbbox()
-                    if bbox:
-                        cropped_img = img.crop(bbox)
-                        template_map.append({
-                            'img': cropped_img,
-                            'pixels': cropped_img.load(),
-                            'bbox': bbox
-                        })
-            except Exception as e:
-                print(f'Error loading template image {path}: {e}')
+    if template_from_user is not None:
+        template = await asyncio.to_thread(compile_template_raster, canvas, template_from_user)
     else:
-        if canvas not in global_template_map:
-            await asyncio.to_thread(create_template_cache, canvas)
-        template_map = global_template_map[canvas]
-        initial_canvas = global_initial_canvas[canvas]
-    if not template_map or initial_canvas is None:
-        print("Failed to load initial canvas.")
-        return 0, 0
-    
-    @functools.lru_cache(maxsize=50000)
-    def get_template_pixel(x, y):
-        correct_colours = set()
-        has_virgin = False
-        for tpe in template_map:
-            bbox = tpe['bbox']
-            if bbox[0] <= x < bbox[2] and bbox[1] <= y < bbox[3]:
-                try:
-                    crop_x = x - bbox[0]
-                    crop_y = y - bbox[1]
-                    pixel = tpe['pixels'][crop_x, crop_y]
-                    if len(pixel) == 4 and pixel[3] > 0:
-                        target_rgb = (pixel[0], pixel[1], pixel[2])
-                        correct_colours.add(target_rgb)
-                        if target_rgb == initial_canvas[x, y]:
-                            has_virgin = True
-                except IndexError:
-                    pass
-        return frozenset(correct_colours), has_virgin
-    
-    tpe_place = {}
-    tpe_grief = {}
+        missing = object()
+        template = global_template_map.get(canvas, missing) # loaded already, no need to leave the event loop
+        if template is not missing:
+            return template
+        if canvas in template_ready and not template_ready[canvas].done() and canvas not in template_pending: # being preloaded right now
+            template = await asyncio.shield(template_ready[canvas])
+        else: # not picked up by the preload yet, or evicted since (then it's reloaded from the template cache)
+            if canvas in template_pending:
+                template_pending.remove(canvas)
+            template = await template_flights.run(canvas, lambda: asyncio.to_thread(load_template_cache, canvas))
+    if template is None:
+        print("Failed to load templates or initial canvas.")
+    return template
+
+
+async def load_template_raster(canvas: str) -> Optional[templates.TemplateRaster]:
+    """Like get_template_raster, but templates that aren't loaded yet are compiled (or read from the template cache) in a worker process.
+
+    Used to load templates for many canvases at once without the loads queueing up on threads.
+    """
+    if canvas in global_template_map or canvas in template_pending or (canvas in template_ready and not template_ready[canvas].done()):
+        return await get_template_raster(canvas)
+    future = asyncio.get_running_loop().create_future()
+    template_ready[canvas] = future # anyone else asking for this canvas waits for this load
+    loading_time_begin = time.time()
+    try:
+        build_args = template_build_args(canvas)
+        if not build_args[1]:
+            template, source = None, 'empty'
+        else:
+            template, source = await workers.run(templates.build_raster, *build_args)
+    except asyncio.CancelledError:
+        template_ready.pop(canvas, None) # let the next caller load it
+        future.cancel()
+        raise
+    except Exception as e:
+        print(f'Failed to load templates for c{canvas}: {e}')
+        template, source = None, 'failed'
+    finish_template_load(canvas, template, source, time.time() - loading_time_begin)
+    return template
 
-    with open(user_log_file, newline='') as csvfile:
-        reader = csv.reader(csvfile, delimiter='\t')
-        for row in reader:
-            if len(row) < 6:
-                continue
-            try:
-                x = int(row[2].strip())
-                y = int(row[3].strip())
-                coord = (x, y)
-                index = int(row[4].strip())
-                placed_rgb = palette_rgb[index]
-                action = row[5].strip()
-            except (ValueError, IndexError):
-                continue
-            if action == 'user undo':
-                if coord in tpe_place:
-                    tpe_place[coord] -= 1
-                    if tpe_place[coord] <= 0:
-                        del tpe_place[coord]
-                if coord in tpe_grief:
-                    tpe_grief[coord] -= 1
-                    if tpe_grief[coord] <= 0:
-                        del tpe_grief[coord]
-            if action != 'user place':
-                continue
-            
-            correct_colours, has_virgin = get_template_pixel(x, y)
-            
-            is_correct = False
-            is_virgin = False
-            present = bool(correct_colours)
-            if present:
-                if placed_rgb in correct_colours:
-                    is_correct = True
-                elif has_virgin:
-                    is_virgin = True
-                    
-            if is_correct or is_virgin: # since it passed the for loop, add as correct
-                tpe_place[coord] = tpe_place.get(coord, 0) + 1
-                tpe_grief.pop(coord, None)
-            elif present and not is_correct: # fails is_correct check, fails is_virgin check, but is present, thus it's a grief
-                tpe_grief[coord] = tpe_grief.get(coord, 0) + 1
-                tpe_place.pop(coord, None)
-    tpe_pixels = sum(tpe_place.values())
-    tpe_griefs = sum(tpe_grief.values())
-    return tpe_pixels - tpe_griefs, tpe_griefs # I return tpe_pixels - tpe_griefs, so I don't have to do that math everywhere else lol
+
+def template_build_args(canvas: str) -> tuple[str, list[str], list[tuple[int, int, int]], str, str]:
+    """Everything templates.build_raster needs for a canvas."""
+    template_paths = saved_template_paths(canvas)
+    palette_path, initial_canvas_path = config.palette_initial_paths(canvas)
+    try:
+        palette = read_gpl_palette(palette_path)
+    except FileNotFoundError as e:
+        print(f'{e}')
+        palette = []
+    return canvas, template_paths, palette, initial_canvas_path, template_cache_path(canvas)
+
+
+def saved_template_paths(canvas: str) -> list[str]:
+    """The template images saved for a canvas (template/c{canvas}/*.png), sorted."""
+    template_dir = os.path.join(ROOT_DIR, 'template', f'c{canvas}')
+    if not os.path.isdir(template_dir):
+        return []
+    with os.scandir(template_dir) as entries:
+        return sorted(entry.path for entry in entries if entry.is_file() and entry.name.lower().endswith('.png'))
+
+
+def template_cache_path(canvas: str) -> str:
+    """Where the compiled templates for a canvas are cached on disk."""
+    return os.path.join(TEMPLATE_CACHE_DIR, f'c{canvas}.npz')
+
+
+def finish_template_load(canvas: str, template: Optional[templates.TemplateRaster], source: str, elapsed: float):
+    """Store a loaded TemplateRaster, record how long it took and wake up anyone waiting for it.
+
+    Failed loads aren't stored, so the next request for the canvas tries again.
+    """
+    if source != 'failed':
+        global_template_map[canvas] = template
+    size = template.nbytes if template is not None else 0
+    template_timings[canvas] = {'seconds': elapsed, 'source': source, 'bytes': size}
+    print(f'c{canvas} template loading took {elapsed:.3f}s ({source}, {size / 1024:.1f}KiB)')
+    future = template_ready.get(canvas)
+    if future is not None and not future.done():
+        future.get_loop().call_soon_threadsafe(lambda: future.done() or future.set_result(template))
+
+
+def load_template_cache(canvas: str) -> Optional[templates.TemplateRaster]:
+    """Read a canvas's templates from the template cache (compiling them if it's out of date) and keep them in memory.
+
+    Runs in a thread, once per canvas at a time (see template_flights).
+    """
+    loading_time_begin = time.time()
+    try:
+        template, source = templates.build_raster(*template_build_args(canvas))
+    except Exception as e:
+        print(f'Failed to load templates for c{canvas}: {e}')
+        template, source = None, 'failed'
+    finish_template_load(canvas, template, source, time.time() - loading_time_begin)
+    return template
 
 
 async def tpe_pixels_count_user(user_id: int, callback=None) -> dict:
@@ -551,31 +689,73 @@ async def tpe_pixels_count_user_canvas(user_id: Optional[int] = None, canvas: Op
                         found_user_logs.append(entry.name)
 
     results: dict[Union[int, str], dict] = {}
-    total = len(found_user_logs)
     file_regex = re.compile(r'^(\d+)_pixels_c(.+)\.log$', flags=re.IGNORECASE)
-
-    for idx, filename in enumerate(found_user_logs):
+    jobs = []
+    for filename in found_user_logs:
         match = file_regex.match(filename)
         if not match:
             print('Regex failed, continuing')
             continue
-        found_user_id = int(match.group(1))
-        found_canvas = match.group(2)
-        user_log_file = os.path.join(user_logs_dir, filename)
-
+        jobs.append((int(match.group(1)), match.group(2), os.path.join(user_logs_dir, filename)))
+    total = len(jobs)
+
+    # reuse stored stats whose user log and templates haven't changed since they were counted
+    stored = await stored_tpe_stats(user_id=user_id, canvas=canvas)
+    template_fingerprints = {}
+    for found_canvas in dict.fromkeys(job[1] for job in jobs):
+        template_fingerprints[found_canvas] = await asyncio.to_thread(template_set_fingerprint, found_canvas)
+    stale = []
+    for found_user_id, found_canvas, user_log_file in jobs:
+        result_key = found_canvas if user_id is not None else found_user_id
+        try:
+            fingerprint = log_fingerprint(user_log_file)
+        except OSError:
+            fingerprint = None
+        row = stored.get((found_user_id, found_canvas))
+        if fingerprint and row and row[0] == fingerprint and row[1] == template_fingerprints[found_canvas]:
+            results[result_key] = {'total_pixels': row[2], 'undo': row[3], 'tpe_pixels': row[4], 'tpe_griefs': row[5]}
+        else:
+            stale.append((found_user_id, found_canvas, user_log_file, fingerprint))
+    print(f'{total - len(stale)}/{total} TPE stats are up to date, counting {len(stale)}')
+
+    if canvas is not None:
+        if stale:
+            await get_template_raster(canvas) # load the templates once, before every log needs them
+        template_loads = {}
+    else: # start loading every stale canvas's templates now, so each log can be parsed as soon as its canvas is ready
+        template_loads = {found_canvas: asyncio.ensure_future(load_template_raster(found_canvas))
+                          for found_canvas in dict.fromkeys(job[1] for job in stale)}
+    limiter = asyncio.Semaphore(max(1, config.worker_processes()))
+    counted = []
+
+    async def process_log(found_user_id: int, found_canvas: str, user_log_file: str, fingerprint: Optional[str]) -> Union[int, str]:
+        result_key = found_canvas if user_id is not None else found_user_id
+        if found_canvas in template_loads:
+            await template_loads[found_canvas]
+        async with limiter:
+            success = await find_tpe_stats(canvas=found_canvas, ple_dir=ple_dir, results=results, user_id=found_user_id, user_log_file=user_log_file, result_key=result_key)
+        if success and fingerprint:
+            stats = results[result_key]
+            counted.append((found_user_id, found_canvas, fingerprint, template_fingerprints[found_canvas],
+                            stats['total_pixels'], stats['undo'], stats['tpe_pixels'], stats['tpe_griefs'], None))
+        return result_key
+
+    # logs are spread over the worker processes, progress is reported in the order they finish
+    finished = total - len(stale)
+    for next_done in asyncio.as_completed([process_log(*job) for job in stale]):
+        result_key = await next_done
+        finished += 1
         if user_id is not None:
-            result_key = found_canvas
-            to_print = f'Processing c{found_canvas} ({idx + 1}/{total}) for user {user_id}'
+            to_print = f'Processed c{result_key} ({finished}/{total}) for user {user_id}'
         else:
-            result_key = found_user_id
-            to_print = f'Processing user {found_user_id} ({idx + 1}/{total}) for c{canvas}'
-
-        if callback and ((idx + 1) % 10 == 0 or (idx + 1) == total):
-            await callback(result_key, idx + 1, total)
+            to_print = f'Processed user {result_key} ({finished}/{total}) for c{canvas}'
+        # a user has a few dozen canvases at most, so each one is reported; a canvas can have hundreds of users
+        if callback and (user_id is not None or finished % 10 == 0 or finished == total):
+            await callback(result_key, finished, total)
         else:
             print(to_print)
-
-        await find_tpe_stats(canvas=found_canvas, ple_dir=ple_dir, results=results, user_id=found_user_id, user_log_file=user_log_file, result_key=result_key)
+    if counted:
+        await record_tpe_stats(counted)
     return results
 
 
@@ -589,48 +769,57 @@ async def find_tpe_stats(canvas: str, ple_dir, results: dict[Union[int, str], di
         user_id (int): The user ID to find stats for.
         user_log_file (_type_): The user log file path.
         result_key (Optional[Union[int, str]], optional): The key to use in the results dictionary. Defaults to None.
+
+    Returns:
+        bool: Whether the log could be read (if not, the results are all 0).
     """
-    _, palette_path, _ = config.paths(canvas, user_id, 'normal')
-    temp_pattern = os.path.join(ROOT_DIR, 'template', f'c{canvas}', '*.png')
-    initial_canvas_path = f"{ple_dir}/pxls-canvas/canvas-{canvas}-initial.png"
     try:
-        total_pixels, undo, mod = await pixel_counting(user_log_file)
-        tpe_pixels, tpe_griefs = await tpe_pixels_count(user_log_file, temp_pattern, palette_path,
-                                                        initial_canvas_path)
+        stats = await analyze_user_log(user_log_file, canvas)
         key = result_key if result_key is not None else user_id # to make it work for both functions
         results[key] = {
-            'total_pixels': total_pixels,
-            'undo': undo,
-            'tpe_pixels': tpe_pixels,
-            'tpe_griefs': tpe_griefs,
+            'total_pixels': stats['total_pixels'],
+            'undo': stats['undo'],
+            'tpe_pixels': stats['tpe_pixels'],
+            'tpe_griefs': stats['tpe_griefs'],
         }
+        return True
     except Exception as e:
         print(f'An error occurred while processing canvas {canvas} for user {user_id}: {e}')
         key = result_key if result_key is not None else user_id
         results[key] = {'total_pixels': 0, 'undo': 0, 'tpe_pixels': 0, 'tpe_griefs': 0}
+        return False
 
 
-async def generate_placemap(user: Union[discord.User, discord.Member], canvas: str, nofilter: Optional[bool] = False) -> tuple[bool, dict]:
+async def generate_placemap(user: Union[discord.User, discord.Member], canvas: str, nofilter: Optional[bool] = False,
+                            priority: int = scheduler.INTERACTIVE, on_queue=None) -> tuple[bool, dict]:
     """_summary_
 
     Args:
         user (Union[discord.User, discord.Member]): The Discord user who uses the command.
         canvas (str): The canvas to use.
-        nofilter (Optional[bool], optional): Whether to skip filtering since it's faster. If it fails while True, attempt to generate one anyway. Defaults to False.
+        nofilter (Optional[bool], optional): Whether to reuse the last filtered log even if it's out of date. Filtering is skipped anyway when the
+            log key and sanit log haven't changed since the last filter. If there's no filtered log yet, filter anyway. Defaults to False.
+        priority (int, optional): Scheduler priority class (scheduler.ADMIN, INTERACTIVE or BACKGROUND). Defaults to INTERACTIVE.
+        on_queue (optional): Async callback with the queue position and ETA while the job waits for a slot (see QueueStatus).
+            If the same placemap is already being made, this attaches to that run instead and on_queue isn't called.
 
     Returns:
         tuple[bool, dict]: Whether the operation was successful and the results.
     """
+    return await placemap_flights.run((user.id, canvas, 'normal'),
+                                      lambda: placemap_job(user, canvas, nofilter, priority, on_queue))
+
+
+async def placemap_job(user: Union[discord.User, discord.Member], canvas: str, nofilter: Optional[bool],
+                       priority: int, on_queue) -> tuple[bool, dict]:
+    """The actual work behind generate_placemap (filter, stats, render), run once per (user, canvas) at a time."""
     try:
-        async with semaphore:
+        async with job_scheduler.job(user.id, priority, on_queue):
             filter_start_time = time.time()
-            get_key = "SELECT key FROM logkey WHERE canvas=? AND user=?"
             ple_dir = config.pxlslog_explorer_dir
             logfile = f'{ple_dir}/pxls-logs/pixels_c{canvas}.sanit.log'
-            cursor.execute(get_key, (canvas, user.id))  # does the above
-            user_key = cursor.fetchone()
+            user_key = await db_access.logkey(user.id, canvas)
             mode = 'normal'
-            _, palette_path, _ = config.paths(canvas, user.id, mode)
 
             if not CANVAS_REGEX.fullmatch(canvas):
                 return False, {'error': f'Invalid format! A canvas code may not begin with a c, and can only contain a-z and 0-9.'}
@@ -645,7 +834,6 @@ async def generate_placemap(user: Union[discord.User, discord.Member], canvas: s
             if not user_key:
                 return False, {'error': f'No log key found for this canvas.'}
 
-            user_key = user_key[0]
             if isinstance(user_key, int):
                 return False, {'error': f'Your key is just a bunch of numbers smh.'}
 
@@ -654,51 +842,67 @@ async def generate_placemap(user: Union[discord.User, discord.Member], canvas: s
                 return False, {'error': f'Invalid format! A log key can only contain a-z, and 0-9.'}
             
             user_log_file = f'{ple_dir}/pxls-userlogs-tib/{user.id}_pixels_c{canvas}.log'
-            if not nofilter or not os.path.exists(user_log_file):
-                success = await filter(canvas, user_key, logfile, user_log_file, user.name)
+            fingerprint = filter_fingerprint(user_key, logfile)
+            filter_cached = await filtered_log_is_current(user.id, canvas, fingerprint, user_log_file) or (nofilter and os.path.exists(user_log_file))
+            if not filter_cached:
+                await forget_filtered_log(user.id, canvas)
+                async with job_scheduler.stage('filter'):
+                    success = await filter(canvas, user_key, logfile, user_log_file, user.name)
                 if not success:
                     return False, {'error': f'Filtering failed. Ping Temriel.'}
+                await record_filtered_log(user.id, canvas, fingerprint)
             filter_end_time = time.time()
-            print(f'filter.exe took {filter_end_time - filter_start_time:.2f}s')
-
-            total_pixels, undo, mod = await pixel_counting(user_log_file)
+            timings = {'filter': filter_end_time - filter_start_time, 'filter_cached': filter_cached}
+            if filter_cached:
+                print(f'Filtering skipped, {user_log_file} is up to date (cache hit)')
+            else:
+                print(f'Filtering ({config.filter_engine()}) took {timings["filter"]:.2f}s')
+
+            stats_start_time = time.time()
+            stats_fingerprint = log_fingerprint(user_log_file)
+            tpe_canvas = canvas if config.tpe(canvas) else None
+            stats = await analyze_user_log(user_log_file, tpe_canvas)
+            stats_end_time = time.time()
+            total_pixels = stats['total_pixels']
+            undo = stats['undo']
+            mod = stats['mod']
+            active_x, active_y, active_count = stats['active_x'], stats['active_y'], stats['active_count']
+            replaced_user = stats['replaced_user']
+            tpe_pixels = stats['tpe_pixels']
+            tpe_griefs = stats['tpe_griefs']
 
             survive_start_time = time.time()
-            replaced_user, replaced_other, survived = await survival(user_log_file,
-                                                                    f'{ple_dir}/pxls-final-canvas/canvas-{canvas}-final.png',
-                                                                    await gpl_palette(palette_path))
+            replaced_other, survived = await survival(stats['final_state'], canvas)
             survived_perc = (survived / total_pixels * 100) if total_pixels > 0 else 0
             survived_perc = f'{survived_perc:.2f}'
             survive_end_time = time.time()
 
-            active_start_time = time.time()
-            (active_x, active_y), active_count = await most_active(user_log_file)
-            active_end_time = time.time()
-
+            print(f'Reading the user log took {stats_end_time - stats_start_time:.2f}s')
             print(f'{total_pixels} pixels placed')
             print(f'{undo} pixels undone')
-            print(f'{active_x, active_y} with {active_count} pixels (took {active_end_time - active_start_time:.2f}s)')
+            print(f'{active_x, active_y} with {active_count} pixels')
             print(f'{mod} mod overwrites')
             print(f'{survived} ({survived_perc}%) pixels survived (took {survive_end_time - survive_start_time:.2f}s)')
+            # force-check counts TPE stats on every canvas, so these only stand in for it where templates were used here too
+            template_fingerprint = await asyncio.to_thread(template_set_fingerprint, canvas) if tpe_canvas else ''
+            await record_tpe_stats([(user.id, canvas, stats_fingerprint, template_fingerprint, total_pixels, undo, tpe_pixels, tpe_griefs, survived)])
+
             print(f'{replaced_user} pixels replaced by self')
             print(f'{replaced_other} pixels replaced by others')
-
-            tpe_pixels = 0
-            tpe_griefs = 0
-            if config.tpe(canvas):
-                tpe_start_time = time.time()
-                temp_pattern = os.path.join(ROOT_DIR, 'template', f'c{canvas}', '*.png')
-                initial_canvas_path = f"{ple_dir}/pxls-canvas/canvas-{canvas}-initial.png"
-                tpe_pixels, tpe_griefs = await tpe_pixels_count(user_log_file, temp_pattern, palette_path,
-                                                                initial_canvas_path)
-                tpe_end_time = time.time()
-                print(f'{tpe_pixels} pixels placed for TPE (took {tpe_end_time - tpe_start_time:.2f}s)')
+            if tpe_canvas:
+                print(f'{tpe_pixels} pixels placed for TPE')
                 print(f'{tpe_griefs} pixels griefed')
 
             render_start_time = time.time()
-            render_result, filename, output_path = await render(user, canvas, mode, user_log_file)
+            async with job_scheduler.stage('render'):
+                render_result, filename, output_path = await render(user, canvas, mode, user_log_file)
             render_end_time = time.time()
             print(f'render.exe took {render_end_time - render_start_time:.2f}s')
+            timings.update({
+                'stats': stats_end_time - stats_start_time,
+                'survival': survive_end_time - survive_start_time,
+                'render': render_end_time - render_start_time,
+            })
 
             if render_result.returncode != 0:
                 return False, {'error': f'Something went wrong when generating the placemap! Ping Temriel.'}
@@ -718,7 +922,8 @@ async def generate_placemap(user: Union[discord.User, discord.Member], canvas: s
                 'filename': filename,
                 'output_path': output_path,
                 'user_log_file': user_log_file,
-                'mode': mode  # defaults to normal
+                'mode': mode,  # defaults to normal
+                'timings': timings  # seconds per stage, and whether filtering was skipped
             }
     except Exception as e:
         print(f'Somethinmg went wrong when making a placemap: {e}')
@@ -755,6 +960,26 @@ async def description_format(canvas: str, results: dict) -> str:
     return constructed_desc
 
 
+class QueueStatus:
+    """Shows a job's queue position in a deferred interaction response, then sends the result in its place."""
+    def __init__(self, interaction: discord.Interaction):
+        self.interaction = interaction
+        self.shown = False
+
+    async def __call__(self, position: int, eta: float):
+        self.shown = True
+        await self.interaction.edit_original_response(content=f'Queued at position {position}, starting in about {eta:.0f}s...')
+
+    async def send(self, content: Optional[str] = None, embed: Optional[discord.Embed] = None,
+                   file: Optional[discord.File] = None, view: Optional[discord.ui.View] = None):
+        """Send the result as a followup, or over the queue message if one was shown."""
+        if self.shown:
+            await self.interaction.edit_original_response(content=content, embed=embed, attachments=[file] if file else [], view=view)
+            return
+        kwargs = {key: value for key, value in (('embed', embed), ('file', file), ('view', view)) if value is not None}
+        await self.interaction.followup.send(content, **kwargs)
+
+
 class PlacemapAltView(discord.ui.View):
     def __init__(self, user: Union[discord.User, discord.Member], canvas: str, mode: str, user_log_file: str,
                  timeout: float = 300):
@@ -764,6 +989,7 @@ class PlacemapAltView(discord.ui.View):
         self.mode = mode
         self.user_log_file = user_log_file
         self.pressed = False
+        self.speculative: dict[str, asyncio.Task] = {} # background renders started by prerender()
 
     def disable_button(self, custom_id: str):
         new_view = PlacemapAltView(
@@ -807,13 +1033,51 @@ class PlacemapAltView(discord.ui.View):
         else:
             await interaction.followup.send(embed=embed)
 
+    async def render_alt(self, mode: str) -> tuple[asyncio.subprocess.Process, str, str]:
+        async with job_scheduler.job(self.user.id, scheduler.INTERACTIVE), job_scheduler.stage('render'):
+            return await render(self.user, self.canvas, mode, self.user_log_file)
+
+    def prerender(self):
+        """Render the alternate modes in the background while the user is still looking at the normal placemap,
+        so pressing a button is a render cache hit (or joins the render that's running). Skipped when the bot is busy."""
+        if job_scheduler.busy():
+            print(f'Not pre-rendering for {self.user} on canvas {self.canvas}, the job queue is busy.')
+            return
+        for mode in PRERENDER_MODES:
+            self.speculative[mode] = placemap_flights.start((self.user.id, self.canvas, mode),
+                                                            lambda mode=mode: self.speculative_render(mode))
+
+    async def speculative_render(self, mode: str) -> Optional[tuple[asyncio.subprocess.Process, str, str]]:
+        """A background render of an alternate mode. Returns None if it gave up because the job queue got busy."""
+        async with job_scheduler.job(self.user.id, scheduler.BACKGROUND):
+            if job_scheduler.waiting: # real work showed up while this was queued
+                print(f'Dropping the {mode} pre-render for {self.user} on canvas {self.canvas}, the job queue is busy.')
+                return None
+            placemap_flights.claim((self.user.id, self.canvas, mode)) # rendering now, pressing the button should wait for it
+            async with job_scheduler.stage('render'):
+                return await render(self.user, self.canvas, mode, self.user_log_file)
+
+    async def on_timeout(self):
+        for mode, task in self.speculative.items():
+            if placemap_flights.drop((self.user.id, self.canvas, mode), task):
+                print(f'Cancelled the {mode} pre-render for {self.user} on canvas {self.canvas}, the view timed out.')
+
     async def generate_alt(self, mode: str) -> tuple[
         discord.Embed, Optional[discord.File]]:
         """Function to generate "age" and "activity" placemaps."""
         start_time = time.time()
-        render_result, filename, output_path = await render(self.user, self.canvas, mode, self.user_log_file)
+        key = (self.user.id, self.canvas, mode)
+        self.speculative.pop(mode, None)
+        speculative = placemap_flights.flights.get(key) # this view's pre-render, or another view's for the same placemap
+        if speculative is not None and placemap_flights.drop(key, speculative):
+            await asyncio.gather(speculative, return_exceptions=True) # still queued at background priority, render it now instead
+        result = None
+        while result is None: # None when this attached to a pre-render that dropped itself, then it's a miss
+            result = await placemap_flights.run(key, lambda: self.render_alt(mode))
+        render_result, filename, output_path = result
         if mode == 'activity':
-            (active_x, active_y), active_count = await most_active(self.user_log_file)
+            stats = await analyze_user_log(self.user_log_file)
+            active_x, active_y, active_count = stats['active_x'], stats['active_y'], stats['active_count']
             description = f'**Most Active:** ({active_x}, {active_y}) with {active_count} pixels'
             embed = discord.Embed(
                 title=f'Canvas {self.canvas} ({mode})',
@@ -828,7 +1092,7 @@ class PlacemapAltView(discord.ui.View):
         if render_result.returncode == 0:
             end_time = time.time()
             elapsed_time = end_time - start_time
-            file = discord.File(output_path, filename=filename)
+            file = placemap_file(output_path, filename)
             embed.set_author(
                 name=self.user.global_name or self.user.name,
                 icon_url=self.user.avatar.url if self.user.avatar else self.user.default_avatar.url
@@ -0,0 +1,93 @@
+import io
+from functools import lru_cache
+from PIL import Image, ImageDraw, ImageFont
+import tib_utility.config as config
+from tib_utility.budget_cache import BudgetCache
+
+# rendered /list pages, keyed by (canvas, page, page_size, data version) so any change to points makes them stale
+page_cache = BudgetCache('Leaderboard cache', config.leaderboard_cache_budget(), len)
+
+BG_COLOR = (24, 4, 53)
+HEADER_COLOR = (75, 0, 130)
+EVEN_ROW_COLOR = (34, 11, 76)
+ODD_ROW_COLOR = (29, 8, 65)
+BORDER_COLOR = (138, 43, 226)
+TEXT_COLOR = (255, 255, 255)
+HEADERS = ["Rank", "Username", "Pixels"]
+
+
+@lru_cache(maxsize=8)
+def load_font(font_path: str, font_size: int) -> ImageFont.FreeTypeFont:
+    return ImageFont.truetype(font_path, font_size)
+
+
+@lru_cache(maxsize=16384)
+def text_width(font_path: str, font_size: int, text: str) -> int:
+    """Width of a cell's text in pixels (usernames & numbers repeat a lot between pages and renders)."""
+    return load_font(font_path, font_size).getbbox(text)[2]
+
+
+def render_png(rows: list[tuple[str, int]], first_rank: int, font_path: str, font_size: int, spacing: int = 18) -> bytes:
+    """Draw one /list page.
+
+    Args:
+        rows (list[tuple[str, int]]): (username, pixels) on this page, in order.
+        first_rank (int): The rank of the first row.
+        font_path (str): The font to use.
+        font_size (int): Its size.
+        spacing (int): Space between the columns.
+
+    Returns:
+        bytes: The page as a PNG.
+    """
+    font = load_font(font_path, font_size)
+    top_adjustment = 2
+    bottom_adjustment = 3
+
+    def column_width(header: str, texts: list[str]) -> int:
+        return max(text_width(font_path, font_size, text) for text in (header, *texts)) + 10
+
+    ranks_value = [str(rank) for rank in range(first_rank, first_rank + len(rows))]
+    ranks_width = column_width(HEADERS[0], ranks_value)
+    usernames = [user for user, _ in rows]
+    usernames_width = column_width(HEADERS[1], usernames)
+    pixels = [str(total) for _, total in rows]
+    pixels_width = column_width(HEADERS[2], pixels)
+
+    ranks_start = spacing
+    usernames_start = ranks_start + ranks_width + spacing
+    pixels_start = usernames_start + usernames_width + spacing
+
+    ascent, descent = font.getmetrics()
+    headers_height = ascent + descent + 10
+    rows_height = headers_height
+    image_width = pixels_start + pixels_width + spacing
+    image_height = headers_height + (rows_height * len(rows)) + bottom_adjustment
+    image = Image.new("RGB", (image_width, image_height), color=BG_COLOR)
+    draw = ImageDraw.Draw(image)
+    # header colour
+    draw.rectangle([0, 0, image_width, spacing + top_adjustment + headers_height], fill=HEADER_COLOR)
+
+    # headers
+    for text, start, width in zip(HEADERS, (ranks_start, usernames_start, pixels_start), (ranks_width, usernames_width, pixels_width)):
+        pos_x = start + (width / 2)
+        pos_y = top_adjustment + headers_height / 2 - 1
+        draw.text((pos_x, pos_y), text, fill=TEXT_COLOR, font=font, anchor="mm")
+
+    # rows
+    y = headers_height
+    for i, (rank, user, total_all) in enumerate(zip(ranks_value, usernames, pixels)):
+        row_color = EVEN_ROW_COLOR if i % 2 == 0 else ODD_ROW_COLOR
+        draw.rectangle([0, y, image_width, y + rows_height], fill=row_color)
+        for text, start, width in ((rank, ranks_start, ranks_width), (user, usernames_start, usernames_width), (total_all, pixels_start, pixels_width)):
+            pos_x = start + (width / 2)
+            pos_y = y + rows_height / 2 - 1
+            draw.text((pos_x, pos_y), text, fill="white", font=font, anchor="mm")
+        y += rows_height
+
+    # draw border (last)
+    draw.rectangle([0, 0, image_width - 1, image_height - 1], outline=BORDER_COLOR, width=2)
+
+    with io.BytesIO() as image_binary:
+        image.save(image_binary, 'PNG')
+        return image_binary.getvalue()
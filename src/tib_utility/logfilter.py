@@ -0,0 +1,98 @@
+import hashlib
+import mmap
+import os
+from concurrent.futures import Executor
+from typing import Optional
+
+CHUNK_SIZE = 64 * 1024 * 1024 # bytes of sanit log per job, small enough to keep a few in memory per worker
+
+
+def match_lines(lines, keys: list[bytes]) -> list[list[bytes]]:
+    """Find the lines of a sanit log that belong to each key.
+
+    A line belongs to a key when its hash column is the hex sha256 of "date,x,y,index,key".
+
+    Args:
+        lines: Raw lines (bytes) of a sanit log.
+        keys (list[bytes]): The log keys to look for.
+
+    Returns:
+        list[list[bytes]]: Per key (in the same order), the matching lines, newline-terminated and in file order.
+    """
+    matches = [[] for _ in keys]
+    for line in lines:
+        parts = line.split(b'\t', 5)
+        if len(parts) < 6:
+            continue
+        prefix = b'%s,%s,%s,%s,' % (parts[0], parts[2], parts[3], parts[4])
+        for i, key in enumerate(keys):
+            if hashlib.sha256(prefix + key).hexdigest().encode() == parts[1]:
+                matches[i].append(line if line.endswith(b'\n') else line + b'\n')
+                break # a hash can only ever match one key
+    return matches
+
+
+def write_matches(outputs: list[str], matches: list[list[bytes]]) -> list[int]:
+    """Write each key's lines to its output file, returning the number of lines written per output."""
+    counts = []
+    for output, lines in zip(outputs, matches):
+        os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+        with open(output, 'wb') as f:
+            f.writelines(lines)
+        counts.append(len(lines))
+    return counts
+
+
+def split_ranges(logfile: str, chunk_size: int = CHUNK_SIZE) -> list[tuple[int, int]]:
+    """Split a file into byte ranges of roughly chunk_size that all end right after a newline (or at the end of the file)."""
+    size = os.path.getsize(logfile)
+    if size == 0:
+        return []
+    ranges = []
+    with open(logfile, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        start = 0
+        while start < size:
+            end = mm.find(b'\n', min(start + chunk_size, size) - 1)
+            end = size if end == -1 else end + 1
+            ranges.append((start, end))
+            start = end
+    return ranges
+
+
+def match_range(logfile: str, start: int, end: int, keys: list[bytes]) -> list[list[bytes]]:
+    """match_lines over one byte range of a file (see split_ranges). Only takes plain arguments so it can run in a worker process."""
+    with open(logfile, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        chunk = mm[start:end]
+    return match_lines(chunk.splitlines(keepends=True), keys)
+
+
+def filter_keys(logfile: str, outputs: dict[str, str], executor: Optional[Executor] = None,
+                chunk_size: int = CHUNK_SIZE) -> dict[str, int]:
+    """Filter a sanit log for several log keys in one pass, like running filter.exe once per key.
+
+    With an executor the log is split into newline-aligned chunks that are matched in parallel,
+    and the results are put back together in file order.
+
+    Args:
+        logfile (str): The sanit log (pxls-logs/pixels_c{canvas}.sanit.log).
+        outputs (dict[str, str]): Log key to the file its lines should be written to.
+        executor (Optional[Executor]): A (process) pool to match chunks on. If None, the log is read line by line here.
+        chunk_size (int): Roughly how many bytes of log each job gets.
+
+    Returns:
+        dict[str, int]: Log key to the number of lines written for it.
+    """
+    keys = list(outputs)
+    encoded_keys = [key.encode() for key in keys]
+    if executor is None:
+        with open(logfile, 'rb') as f:
+            matches = match_lines(f, encoded_keys)
+    else:
+        ranges = split_ranges(logfile, chunk_size)
+        matches = [[] for _ in keys]
+        jobs = [executor.submit(match_range, logfile, start, end, encoded_keys) for start, end in ranges]
+        for job in jobs: # in file order
+            for lines, chunk_lines in zip(matches, job.result()):
+                lines.extend(chunk_lines)
+    counts = write_matches([outputs[key] for key in keys], matches)
+    return dict(zip(keys, counts))
@@ -0,0 +1,168 @@
+import sqlite3
+import time
+import tib_utility.db_access as db_access
+
+# rebuild user_totals & canvas_totals from points
+REBUILD_TOTALS = [
+    'DELETE FROM user_totals',
+    'INSERT INTO user_totals SELECT user, COALESCE(SUM(pixels), 0), COUNT(*) FROM points GROUP BY user',
+    'DELETE FROM canvas_totals',
+    'INSERT INTO canvas_totals SELECT canvas, COALESCE(SUM(pixels), 0), COUNT(*) FROM points GROUP BY canvas',
+]
+
+# (version, description, statements), applied in order by migrate(). Only ever append, never edit an applied one.
+MIGRATIONS: list[tuple[int, str, list[str]]] = [
+    (1, 'Base tables', [
+        'CREATE TABLE IF NOT EXISTS points(user STR, canvas STR, pixels INT, PRIMARY KEY (user, canvas))',
+        'CREATE TABLE IF NOT EXISTS users (user_id INT, username STR UNIQUE, notif_status BOOLEAN DEFAULT 0, PRIMARY KEY (user_id))',
+        'CREATE TABLE IF NOT EXISTS logkey(user INT, canvas STR, key STR, PRIMARY KEY (user, canvas))',
+        'CREATE TABLE IF NOT EXISTS filtered_log(user INT, canvas STR, fingerprint STR, PRIMARY KEY (user, canvas))',
+        'CREATE TABLE IF NOT EXISTS tpe_stats(user INT, canvas STR, log_fingerprint STR, template_fingerprint STR, total_pixels INT, undo INT, tpe_pixels INT, tpe_griefs INT, survived INT, PRIMARY KEY (user, canvas))',
+    ]),
+    (2, 'Covering indexes for the leaderboard, graph & per-user queries', [
+        'CREATE INDEX IF NOT EXISTS points_canvas_user ON points(canvas, user, pixels)', # /graph all, dropped in 4
+        'CREATE INDEX IF NOT EXISTS points_user ON points(user, canvas, pixels)', # /list, /lookup, /graph user, COUNT(DISTINCT user)
+        'CREATE INDEX IF NOT EXISTS users_notif_status ON users(notif_status, user_id)', # /admin notify-users
+        'CREATE INDEX IF NOT EXISTS tpe_stats_canvas ON tpe_stats(canvas)', # force-check-canvas
+    ]),
+    (3, 'Per-user and per-canvas totals kept up to date by triggers on points', [
+        'CREATE TABLE IF NOT EXISTS user_totals(user STR PRIMARY KEY, pixels INT NOT NULL, canvases INT NOT NULL)',
+        'CREATE TABLE IF NOT EXISTS canvas_totals(canvas STR PRIMARY KEY, pixels INT NOT NULL, users INT NOT NULL)',
+        'CREATE INDEX IF NOT EXISTS user_totals_pixels ON user_totals(pixels DESC, user)',
+        *REBUILD_TOTALS,
+        # INSERT OR REPLACE only fires the delete trigger for the replaced row with recursive_triggers on (see db_access.connect),
+        # a plain connection that replaces rows leaves the totals off until check_totals() catches it
+        '''CREATE TRIGGER IF NOT EXISTS points_totals_insert AFTER INSERT ON points BEGIN
+            INSERT INTO user_totals VALUES (NEW.user, COALESCE(NEW.pixels, 0), 1)
+                ON CONFLICT(user) DO UPDATE SET pixels = pixels + excluded.pixels, canvases = canvases + 1;
+            INSERT INTO canvas_totals VALUES (NEW.canvas, COALESCE(NEW.pixels, 0), 1)
+                ON CONFLICT(canvas) DO UPDATE SET pixels = pixels + excluded.pixels, users = users + 1;
+        END''',
+        '''CREATE TRIGGER IF NOT EXISTS points_totals_delete AFTER DELETE ON points BEGIN
+            UPDATE user_totals SET pixels = pixels - COALESCE(OLD.pixels, 0), canvases = canvases - 1 WHERE user = OLD.user;
+            DELETE FROM user_totals WHERE user = OLD.user AND canvases <= 0;
+            UPDATE canvas_totals SET pixels = pixels - COALESCE(OLD.pixels, 0), users = users - 1 WHERE canvas = OLD.canvas;
+            DELETE FROM canvas_totals WHERE canvas = OLD.canvas AND users <= 0;
+        END''',
+        '''CREATE TRIGGER IF NOT EXISTS points_totals_update AFTER UPDATE OF user, canvas, pixels ON points BEGIN
+            UPDATE user_totals SET pixels = pixels - COALESCE(OLD.pixels, 0), canvases = canvases - 1 WHERE user = OLD.user;
+            DELETE FROM user_totals WHERE user = OLD.user AND canvases <= 0;
+            UPDATE canvas_totals SET pixels = pixels - COALESCE(OLD.pixels, 0), users = users - 1 WHERE canvas = OLD.canvas;
+            DELETE FROM canvas_totals WHERE canvas = OLD.canvas AND users <= 0;
+            INSERT INTO user_totals VALUES (NEW.user, COALESCE(NEW.pixels, 0), 1)
+                ON CONFLICT(user) DO UPDATE SET pixels = pixels + excluded.pixels, canvases = canvases + 1;
+            INSERT INTO canvas_totals VALUES (NEW.canvas, COALESCE(NEW.pixels, 0), 1)
+                ON CONFLICT(canvas) DO UPDATE SET pixels = pixels + excluded.pixels, users = users + 1;
+        END''',
+    ]),
+    (4, 'Index for paging through a canvas leaderboard', [
+        'CREATE INDEX IF NOT EXISTS points_canvas_pixels ON points(canvas, pixels DESC, user)',
+        'DROP INDEX IF EXISTS points_canvas_user', # points_canvas_pixels covers the same columns, with canvas first too
+    ]),
+    (5, 'Version counter for points, to tell when cached leaderboards are stale', [
+        'CREATE TABLE IF NOT EXISTS data_version(name STR PRIMARY KEY, version INT NOT NULL)',
+        "INSERT OR IGNORE INTO data_version VALUES ('points', 0)",
+        "CREATE TRIGGER IF NOT EXISTS points_version_insert AFTER INSERT ON points BEGIN UPDATE data_version SET version = version + 1 WHERE name = 'points'; END",
+        "CREATE TRIGGER IF NOT EXISTS points_version_update AFTER UPDATE ON points BEGIN UPDATE data_version SET version = version + 1 WHERE name = 'points'; END",
+        "CREATE TRIGGER IF NOT EXISTS points_version_delete AFTER DELETE ON points BEGIN UPDATE data_version SET version = version + 1 WHERE name = 'points'; END",
+    ]),
+]
+
+# (query, parameters, indexes it may use) for the hot queries, see check_query_plans. Paginated queries must get their
+# order from the index too, so a page doesn't sort the whole table.
+HOT_QUERIES: list[tuple[str, tuple, tuple[str, ...]]] = [
+    (db_access.USER_TOTAL, ('user',), ('sqlite_autoindex_user_totals_1',)),
+    (db_access.USER_CANVAS_PIXELS, ('user',), ('points_user',)),
+    (db_access.LEADERBOARD_PAGE, (30, 0), ('user_totals_pixels',)),
+    (db_access.CANVAS_LEADERBOARD_PAGE, ('1', 30, 0), ('points_canvas_pixels',)),
+    (db_access.LOGKEY_CANVASES, (1,), ('sqlite_autoindex_logkey_1',)),
+    (db_access.LINKED_DISCORD_ID, ('user',), ('sqlite_autoindex_users_1',)),
+    (db_access.NOTIFICATION_USERS, (), ('users_notif_status',)),
+]
+
+
+def schema_version(connection: sqlite3.Connection) -> int:
+    connection.execute('CREATE TABLE IF NOT EXISTS schema_version(version INT PRIMARY KEY, description STR, applied_at INT)')
+    return connection.execute('SELECT COALESCE(MAX(version), 0) FROM schema_version').fetchone()[0]
+
+
+def migrate(connection: sqlite3.Connection) -> int:
+    """Apply every migration newer than the database's schema_version, each in its own transaction.
+
+    Args:
+        connection (sqlite3.Connection): A connection not in the middle of a transaction.
+
+    Returns:
+        int: The schema version the database is at now.
+    """
+    isolation_level = connection.isolation_level
+    connection.isolation_level = None # BEGIN/COMMIT by hand, so the DDL is part of the transaction
+    try:
+        current = schema_version(connection)
+        for version, description, statements in MIGRATIONS:
+            if version <= current:
+                continue
+            connection.execute('BEGIN IMMEDIATE')
+            try:
+                if schema_version(connection) >= version: # applied by another process (eg. the GUI) in the meantime
+                    connection.execute('ROLLBACK')
+                    continue
+                for statement in statements:
+                    connection.execute(statement)
+                connection.execute('INSERT INTO schema_version VALUES (?, ?, ?)', (version, description, int(time.time())))
+                connection.execute('COMMIT')
+            except BaseException:
+                connection.execute('ROLLBACK')
+                raise
+            print(f'Applied database migration {version}: {description}')
+            current = version
+        connection.execute('PRAGMA optimize')
+        return current
+    finally:
+        connection.isolation_level = isolation_level
+
+
+def check_totals(connection: sqlite3.Connection) -> list[str]:
+    """Compare user_totals & canvas_totals with SUM(pixels) over points, eg. after rows were replaced without recursive_triggers.
+
+    Returns:
+        list[str]: A description of every table that's off (empty if both match).
+    """
+    problems = []
+    for table, column, count in (('user_totals', 'user', 'canvases'), ('canvas_totals', 'canvas', 'users')):
+        mismatched = connection.execute(f'''SELECT COUNT(*) FROM (
+            SELECT {column}, COALESCE(SUM(pixels), 0), COUNT(*) FROM points GROUP BY {column}
+            EXCEPT SELECT {column}, pixels, {count} FROM {table}
+            UNION ALL
+            SELECT {column}, pixels, {count} FROM {table}
+            EXCEPT SELECT {column}, COALESCE(SUM(pixels), 0), COUNT(*) FROM points GROUP BY {column})''').fetchone()[0]
+        if mismatched:
+            problems.append(f'{table} has {mismatched} rows that don\'t match points')
+    return problems
+
+
+def rebuild_totals(connection: sqlite3.Connection):
+    with connection:
+        for statement in REBUILD_TOTALS:
+            connection.execute(statement)
+
+
+def query_plan(connection: sqlite3.Connection, query: str, params: tuple = ()) -> list[str]:
+    """The EXPLAIN QUERY PLAN lines of a query."""
+    return [row[3] for row in connection.execute(f'EXPLAIN QUERY PLAN {query}', params).fetchall()]
+
+
+def check_query_plans(connection: sqlite3.Connection) -> list[str]:
+    """Check that every hot query uses one of the indexes it was given, instead of reading (or sorting) the whole table.
+
+    Returns:
+        list[str]: A description of every query that doesn't (empty if all is well).
+    """
+    problems = []
+    for query, params, indexes in HOT_QUERIES:
+        plan = query_plan(connection, query, params)
+        if not any(f'INDEX {index}' in line for line in plan for index in indexes):
+            problems.append(f'{query} doesn\'t use {" or ".join(indexes)}: {" / ".join(plan)}')
+        elif 'LIMIT' in query and any('TEMP B-TREE FOR ORDER BY' in line for line in plan):
+            problems.append(f'{query} sorts its results instead of reading them in index order: {" / ".join(plan)}')
+    return problems
@@ -0,0 +1,102 @@
+import io
+import numpy as np
+from PIL import Image
+from tib_utility.userlog import UserLog, PLACE, UNDO, COORD_STRIDE
+
+NATIVE_MODES = ('normal', 'activity', 'age', 'virgin')
+RENDERER_VERSION = 1 # part of the render cache key, bump it whenever the output of render_placemap changes
+
+# gradient stops (position, rgb) for the activity and age modes
+HEAT_GRADIENT = [(0.0, (0, 0, 96)), (0.35, (160, 0, 160)), (0.7, (255, 96, 0)), (1.0, (255, 255, 160))]
+AGE_GRADIENT = [(0.0, (24, 24, 48)), (0.5, (32, 128, 160)), (1.0, (224, 255, 224))]
+VIRGIN_COLOUR = (255, 255, 255)
+PLACED_COLOUR = (0, 0, 0)
+
+
+def gradient(values: np.ndarray, stops: list[tuple[float, tuple[int, int, int]]]) -> np.ndarray:
+    """Map values in [0, 1] onto a piecewise linear colour gradient, returning an (n, 3) uint8 array."""
+    positions = [position for position, _ in stops]
+    channels = [np.interp(values, positions, [colour[channel] for _, colour in stops]) for channel in range(3)]
+    return np.stack(channels, axis=-1).round().astype(np.uint8)
+
+
+def final_placements(log: UserLog) -> np.ndarray:
+    """Row of the last placement on every pixel that wasn't undone afterwards (same rules as userlog.read_user_log)."""
+    rows = np.flatnonzero((log.action == PLACE) | (log.action == UNDO))
+    coords = log.coord
+    order = rows[np.argsort(coords[rows], kind='stable')]
+    sorted_coords = coords[order]
+    is_last = np.r_[sorted_coords[1:] != sorted_coords[:-1], True] if len(order) else np.zeros(0, dtype=bool)
+    return order[is_last & (log.action[order] == PLACE)]
+
+
+def render_placemap(log: UserLog, background: np.ndarray, palette: list[tuple[int, int, int]], mode: str) -> np.ndarray:
+    """Draw a user's placemap over the background canvas, framed like render.exe's --screenshot (the whole canvas).
+
+    Args:
+        log (UserLog): The filtered user log (loaded with_time for 'age').
+        background (np.ndarray): The background canvas as an (height, width, 4) RGBA array.
+        palette (list[tuple[int, int, int]]): The canvas palette.
+        mode (str): One of NATIVE_MODES.
+
+    Returns:
+        np.ndarray: The placemap as an RGBA array the size of the background.
+    """
+    if mode not in NATIVE_MODES:
+        raise ValueError(f'Mode {mode} can\'t be rendered natively.')
+    image = background.copy()
+    height, width = image.shape[:2]
+    inside = (log.x >= 0) & (log.y >= 0) & (log.x < width) & (log.y < height)
+    places = np.flatnonzero(inside & (log.action == PLACE))
+
+    if mode == 'normal':
+        rows = final_placements(log)
+        rows = rows[inside[rows]]
+        index = log.index[rows]
+        index = np.where(index < 0, index + len(palette), index) # same as indexing into the palette
+        valid = (index >= 0) & (index < len(palette))
+        rows = rows[valid]
+        colours = np.array(palette, dtype=np.uint8).reshape(-1, 3)[index[valid]]
+        image[log.y[rows], log.x[rows], :3] = colours
+        image[log.y[rows], log.x[rows], 3] = 255
+        return image
+
+    if mode == 'virgin':
+        image[..., :3] = VIRGIN_COLOUR
+        image[log.y[places], log.x[places], :3] = PLACED_COLOUR
+        image[log.y[places], log.x[places], 3] = 255
+        return image
+
+    coords = log.y[places].astype(np.int64) * COORD_STRIDE + log.x[places]
+    if not len(coords):
+        return image
+    if mode == 'activity':
+        unique_coords, counts = np.unique(coords, return_counts=True)
+        values = np.log1p(counts) / np.log1p(counts.max()) # log scale, a few spam pixels shouldn't wash out the rest
+    else: # age, brighter is more recent
+        if log.time is None:
+            raise ValueError('The age mode needs the user log loaded with_time.')
+        times = log.time[places]
+        order = np.lexsort((times, coords))
+        last = np.r_[coords[order][1:] != coords[order][:-1], True]
+        unique_coords = coords[order][last]
+        last_times = times[order][last]
+        span = last_times.max() - times.min()
+        values = (last_times - times.min()) / span if span > 0 else np.ones(len(last_times))
+    y, x = np.divmod(unique_coords, COORD_STRIDE)
+    image[y, x, :3] = gradient(values, HEAT_GRADIENT if mode == 'activity' else AGE_GRADIENT)
+    image[y, x, 3] = 255
+    return image
+
+
+def load_background(path: str) -> np.ndarray:
+    with Image.open(path) as img:
+        return np.asarray(img.convert('RGBA')).copy()
+
+
+def render_png(log: UserLog, background_path: str, palette: list[tuple[int, int, int]], mode: str) -> bytes:
+    """render_placemap straight to PNG bytes, for a discord.File or the render cache."""
+    image = render_placemap(log, load_background(background_path), palette, mode)
+    buffer = io.BytesIO()
+    Image.fromarray(image, 'RGBA').save(buffer, format='PNG', compress_level=1)
+    return buffer.getvalue()
@@ -0,0 +1,91 @@
+import asyncio
+import os
+import signal
+import subprocess
+import sys
+from typing import Optional
+import tib_utility.config as config
+
+process_stats: dict[str, dict[str, int]] = {} # per stage: runs, failed, timeouts, cancelled
+
+
+def stage_stats(stage: str) -> dict[str, int]:
+    return process_stats.setdefault(stage, {'runs': 0, 'failed': 0, 'timeouts': 0, 'cancelled': 0})
+
+
+def limited_command(cli: list[str], cpu_seconds: Optional[int], memory_bytes: Optional[int]) -> list[str]:
+    """Wrap a command in a shell that applies the rlimits and then execs it (POSIX only).
+
+    The limits are set by the shell rather than a preexec_fn, which isn't safe to use from a process with threads
+    (the query threads and asyncio.to_thread). The program keeps the shell's pid, so killing the group still works.
+    """
+    limits = []
+    if cpu_seconds:
+        limits.append(f'ulimit -t {cpu_seconds}')
+    if memory_bytes:
+        limits.append(f'ulimit -v {max(1, memory_bytes // 1024)}') # in KiB
+    return ['/bin/sh', '-c', f'{" && ".join(limits)} && exec "$@"', 'sh', *cli]
+
+
+def kill_process_group(process: asyncio.subprocess.Process):
+    """Kill a process and everything it started."""
+    if process.returncode is not None:
+        return
+    try:
+        if sys.platform == 'win32':
+            subprocess.run(['taskkill', '/F', '/T', '/PID', str(process.pid)], capture_output=True)
+        else:
+            os.killpg(process.pid, signal.SIGKILL)
+    except (ProcessLookupError, OSError):
+        process.kill()
+
+
+async def run_process(cli: list[str], stage: str) -> tuple[asyncio.subprocess.Process, str, str]:
+    """Run an external program (filter.exe, render.exe) with the stage's timeout and resource limits.
+
+    The program gets its own process group, which is killed if it runs past config.process_timeout(stage)
+    or if the awaiting task is cancelled (eg. the interaction went away). Inside a SingleFlight run that only happens
+    once every caller waiting on the run has been cancelled (see SingleFlight.run).
+
+    Args:
+        cli (list[str]): The program and its arguments.
+        stage (str): 'filter' or 'render', for the timeout and the stats.
+
+    Returns:
+        tuple[asyncio.subprocess.Process, str, str]: The finished (or killed) process, its stdout and its stderr.
+            A killed process has a non-zero returncode.
+    """
+    stats = stage_stats(stage)
+    stats['runs'] += 1
+    kwargs = {}
+    if sys.platform == 'win32':
+        kwargs['creationflags'] = subprocess.CREATE_NEW_PROCESS_GROUP
+    else:
+        kwargs['start_new_session'] = True
+        cpu_seconds, memory_bytes = config.process_limits()
+        if cpu_seconds or memory_bytes:
+            cli = limited_command(cli, cpu_seconds, memory_bytes)
+    process = await asyncio.create_subprocess_exec(
+        *cli, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE, **kwargs
+    )
+    timeout = config.process_timeout(stage)
+    try:
+        stdout, stderr = await asyncio.wait_for(process.communicate(), timeout=timeout)
+    except asyncio.TimeoutError:
+        stats['timeouts'] += 1
+        print(f'{stage} process {process.pid} timed out after {timeout}s, killing it.')
+        kill_process_group(process)
+        await process.wait()
+        return process, '', f'Timed out after {timeout}s.'
+    except asyncio.CancelledError:
+        stats['cancelled'] += 1
+        print(f'{stage} process {process.pid} was cancelled, killing it.')
+        kill_process_group(process)
+        try:
+            await asyncio.shield(process.wait()) # reap it, or it's left a zombie with its pipes open
+        except asyncio.CancelledError:
+            pass
+        raise
+    if process.returncode != 0:
+        stats['failed'] += 1
+    return process, stdout.decode('utf-8', errors='replace').strip(), stderr.decode('utf-8', errors='replace').strip()
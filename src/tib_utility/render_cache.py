@@ -0,0 +1,144 @@
+import hashlib
+import os
+import shutil
+import threading
+from typing import Optional
+import tib_utility.config as config
+import tib_utility.placemap_render as placemap_render
+
+file_digests: dict[str, tuple[int, int, str]] = {} # path -> (size, mtime, sha256), so unchanged inputs aren't hashed twice
+render_stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+cache_lock = threading.Lock()
+
+
+class FinishedRender:
+    """Stands in for the render.exe process when none ran (a cache hit or a native render)."""
+    returncode = 0
+
+
+def cache_dir() -> str:
+    return f'{config.pxlslog_explorer_dir}/pxls-out-tib/cache'
+
+
+def file_digest(path: str) -> str:
+    """sha256 of a file's contents, remembered until the file changes (one entry per path, a rewrite replaces it)."""
+    stat = os.stat(path)
+    size, mtime, digest = file_digests.get(path, (None, None, None))
+    if size != stat.st_size or mtime != stat.st_mtime_ns:
+        sha = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                sha.update(chunk)
+        digest = sha.hexdigest()
+        file_digests[path] = (stat.st_size, stat.st_mtime_ns, digest)
+    return digest
+
+
+def render_engine(native: bool) -> str:
+    """The renderer a placemap comes from, with its version: render.exe is identified by its digest, so updating
+    pxlslog-explorer doesn't serve placemaps from the old build (and the two renderers never share cache entries)."""
+    if native:
+        return f'native-{placemap_render.RENDERER_VERSION}'
+    return f'render.exe-{file_digest(f"{config.pxlslog_explorer_dir}/render.exe")}'
+
+
+def render_key(user_log_file: str, mode: str, palette_path: str, bg: str, native: bool) -> Optional[str]:
+    """Hash everything a placemap is rendered from (renderer, filtered user log, mode, palette and background canvas).
+
+    Args:
+        native (bool): Whether it's rendered by placemap_render instead of render.exe.
+
+    Returns:
+        Optional[str]: The hex digest, or None if an input is missing (then there's nothing to cache).
+    """
+    try:
+        parts = [render_engine(native), mode, file_digest(user_log_file), file_digest(palette_path), file_digest(bg)]
+    except OSError:
+        return None
+    return hashlib.sha256('\n'.join(parts).encode()).hexdigest()
+
+
+def cache_path(key: str) -> str:
+    return f'{cache_dir()}/{key}.png'
+
+
+def lookup(key: Optional[str], count: bool = True) -> Optional[str]:
+    """The cached placemap for a render key, or None (counted as a hit or a miss).
+
+    Args:
+        count (bool): Whether to count it in the hit/miss stats, False for a second lookup within the same request.
+    """
+    path = cache_path(key) if key else None
+    with cache_lock:
+        if path and os.path.exists(path):
+            os.utime(path) # mark as recently used
+            if count:
+                render_stats['hits'] += 1
+            return path
+        if count:
+            render_stats['misses'] += 1
+        return None
+
+
+def store(key: Optional[str], output_path: str):
+    """Copy a freshly rendered placemap into the cache, then evict the least recently used ones over RENDER_CACHE_MB."""
+    if not key or not os.path.exists(output_path):
+        return
+    path = cache_path(key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    shutil.copyfile(output_path, temp_path)
+    os.replace(temp_path, path)
+    evict(config.render_cache_budget())
+
+
+def store_bytes(key: Optional[str], data: bytes):
+    """Like store(), for a placemap that was rendered in memory."""
+    if not key:
+        return
+    path = cache_path(key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(temp_path, 'wb') as f:
+        f.write(data)
+    os.replace(temp_path, path)
+    evict(config.render_cache_budget())
+
+
+def cached_files() -> list[os.DirEntry]:
+    if not os.path.isdir(cache_dir()):
+        return []
+    with os.scandir(cache_dir()) as entries:
+        return [entry for entry in entries if entry.is_file() and entry.name.endswith('.png')]
+
+
+def evict(budget: int):
+    with cache_lock:
+        files = []
+        for entry in cached_files():
+            stat = entry.stat()
+            files.append((stat.st_mtime, stat.st_size, entry.path))
+        files.sort()
+        total = sum(size for _, size, _ in files)
+        for _, size, path in files:
+            if total <= budget:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            render_stats['evictions'] += 1
+
+
+def stats() -> dict:
+    """Hits, misses, evictions, hit rate, and the number & total size of cached placemaps."""
+    files = cached_files()
+    lookups = render_stats['hits'] + render_stats['misses']
+    return {
+        **render_stats,
+        'hit_rate': render_stats['hits'] / lookups if lookups else 0.0,
+        'entries': len(files),
+        'size': sum(entry.stat().st_size for entry in files),
+        'budget': config.render_cache_budget(),
+    }
@@ -0,0 +1,192 @@
+import asyncio
+import contextlib
+import itertools
+import math
+import time
+from collections import deque
+from typing import Awaitable, Callable, Hashable, Optional
+
+# priority classes, lower runs first
+ADMIN = 0
+INTERACTIVE = 1
+BACKGROUND = 2
+PRIORITY_NAMES = {ADMIN: 'admin', INTERACTIVE: 'interactive', BACKGROUND: 'background'}
+
+REPORT_INTERVAL = 2.0 # how often (seconds) a waiting job checks if its queue position changed
+DEFAULT_JOB_SECONDS = 30.0 # ETA guess per job until some have finished
+
+
+class Job:
+    def __init__(self, owner: Hashable, priority: int, order: int):
+        self.owner = owner
+        self.priority = priority
+        self.order = order
+        self.granted: asyncio.Future = asyncio.get_running_loop().create_future()
+
+
+class JobScheduler:
+    """Runs heavy jobs (placemaps etc.) a few at a time.
+
+    Waiting jobs start in priority order (first come, first served within a class), but a job is skipped while its
+    owner already has per_user jobs running, so one user can't fill every slot. Inside a job, stage() limits how
+    many jobs can be in a given stage (eg. filtering or rendering) at once.
+    """
+    def __init__(self, slots: int, per_user: int, stage_limits: dict[str, int]):
+        self.slots = slots
+        self.per_user = per_user
+        self.stages = {stage: asyncio.Semaphore(limit) for stage, limit in stage_limits.items()}
+        self.waiting: list[Job] = []
+        self.running: dict[Hashable, int] = {}
+        self.active = 0
+        self.counter = itertools.count()
+        self.durations: deque[float] = deque(maxlen=20)
+
+    def queue(self) -> list[Job]:
+        """Waiting jobs in the order they'd start (ignoring the per-user limit)."""
+        return sorted(self.waiting, key=lambda job: (job.priority, job.order))
+
+    def position(self, job: Job) -> int:
+        """How many waiting jobs are ahead of this one."""
+        return self.queue().index(job)
+
+    def eta(self, position: int) -> float:
+        """Rough number of seconds until the job at this queue position starts."""
+        average = sum(self.durations) / len(self.durations) if self.durations else DEFAULT_JOB_SECONDS
+        return math.ceil((position + 1) / self.slots) * average
+
+    def busy(self) -> bool:
+        """Whether every slot is taken or anything is waiting for one."""
+        return bool(self.waiting) or self.active >= self.slots
+
+    def dispatch(self):
+        """Start as many waiting jobs as there are free slots."""
+        for job in self.queue():
+            if self.active >= self.slots:
+                break
+            if self.running.get(job.owner, 0) >= self.per_user:
+                continue
+            self.waiting.remove(job)
+            self.active += 1
+            self.running[job.owner] = self.running.get(job.owner, 0) + 1
+            job.granted.set_result(None)
+
+    def release(self, job: Job):
+        self.active -= 1
+        self.running[job.owner] -= 1
+        if not self.running[job.owner]:
+            del self.running[job.owner]
+        self.dispatch()
+
+    @contextlib.asynccontextmanager
+    async def job(self, owner: Hashable, priority: int = INTERACTIVE,
+                  on_queue: Optional[Callable[[int, float], Awaitable[None]]] = None):
+        """Wait for a slot, then run the body of the `async with` as a job.
+
+        Args:
+            owner (Hashable): Who the job is for (usually a Discord user ID), for per-user fairness.
+            priority (int): ADMIN, INTERACTIVE or BACKGROUND.
+            on_queue (Optional[Callable[[int, float], Awaitable[None]]]): Called with the (1-based) queue position and ETA
+                in seconds whenever the position changes while waiting. Not called if the job starts right away.
+        """
+        job = Job(owner, priority, next(self.counter))
+        self.waiting.append(job)
+        self.dispatch()
+        try:
+            last_position = None
+            while not job.granted.done():
+                position = self.position(job)
+                if on_queue is not None and position != last_position:
+                    last_position = position
+                    try:
+                        await on_queue(position + 1, self.eta(position))
+                    except Exception as e:
+                        print(f'Failed to report queue position: {e}')
+                await asyncio.wait({job.granted}, timeout=REPORT_INTERVAL)
+        except BaseException:
+            if job.granted.done():
+                self.release(job)
+            else:
+                self.waiting.remove(job)
+            raise
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.durations.append(time.time() - start)
+            self.release(job)
+
+    @contextlib.asynccontextmanager
+    async def stage(self, name: str):
+        """Limit how many jobs are in this stage at once (no limit for stages without a configured one)."""
+        semaphore = self.stages.get(name)
+        if semaphore is None:
+            yield
+            return
+        async with semaphore:
+            yield
+
+    def stats(self) -> dict:
+        """Running jobs and waiting jobs per priority class."""
+        waiting = {name: 0 for name in PRIORITY_NAMES.values()}
+        for job in self.waiting:
+            waiting[PRIORITY_NAMES[job.priority]] += 1
+        return {'running': self.active, 'slots': self.slots, 'waiting': waiting}
+
+
+class SingleFlight:
+    """Runs one coroutine per key at a time; callers asking for a key that's already running wait for that run's result instead."""
+    def __init__(self):
+        self.flights: dict[Hashable, asyncio.Task] = {}
+        self.waiters: dict[Hashable, int] = {}
+        self.claimed: set[asyncio.Task] = set() # runs that started their real work, see claim()
+        self.background: set[asyncio.Task] = set() # runs started with start(), they go on without waiters
+
+    def start(self, key: Hashable, factory: Callable[[], Awaitable], background: bool = True) -> asyncio.Task:
+        """Start factory() for this key without waiting for it (or get the run that's already in flight)."""
+        task = self.flights.get(key)
+        if task is None or task.done():
+            task = asyncio.ensure_future(factory())
+            self.flights[key] = task
+            if background:
+                self.background.add(task)
+            task.add_done_callback(lambda done: self.finished(key, done))
+        return task
+
+    def finished(self, key: Hashable, task: asyncio.Task):
+        self.claimed.discard(task)
+        self.background.discard(task)
+        if self.flights.get(key) is task:
+            del self.flights[key]
+
+    async def run(self, key: Hashable, factory: Callable[[], Awaitable]):
+        """Await factory() for this key, or attach to the run that's already in flight.
+
+        A caller being cancelled doesn't cancel the shared run for everyone else, but once the last caller is gone a run
+        started here is cancelled too (so eg. a render.exe nobody is waiting for gets killed). Runs from start() go on.
+        """
+        if key in self.flights and not self.flights[key].done():
+            print(f'Attaching to the job already running for {key}')
+        task = self.start(key, factory, background=False)
+        self.waiters[key] = self.waiters.get(key, 0) + 1
+        try:
+            return await asyncio.shield(task)
+        finally:
+            self.waiters[key] -= 1
+            if not self.waiters[key]:
+                del self.waiters[key]
+                if not task.done() and task not in self.background:
+                    task.cancel()
+
+    def claim(self, key: Hashable):
+        """Called from inside a run once it gets past the point where dropping it would save anything (eg. its render
+        started), so drop() leaves it alone whoever asks."""
+        task = self.flights.get(key)
+        if task is not None and not task.done():
+            self.claimed.add(task)
+
+    def drop(self, key: Hashable, task: asyncio.Task) -> bool:
+        """Cancel a run started with start(), unless it's finished, claimed or somebody is waiting on it. Returns whether it was cancelled."""
+        if task.done() or task in self.claimed or self.flights.get(key) is not task or self.waiters.get(key):
+            return False
+        task.cancel()
+        return True
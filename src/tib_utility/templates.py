@@ -0,0 +1,244 @@
+import hashlib
+import os
+from typing import Optional
+import numpy as np
+from PIL import Image
+import tib_utility.canvas_assets as canvas_assets
+from tib_utility.canvas_assets import palette_keys, UNKNOWN
+
+# flags per cell
+PRESENT = 1 # at least one template covers this pixel
+VIRGIN = 2 # a template wants the initial (virgin) colour here, so any placement counts as correct
+
+
+class TemplateRaster:
+    """Every template on a canvas compiled into a couple of arrays, cropped to the area the templates cover.
+
+    Each cell holds a bitmask of allowed palette indices (bit i set = palette index i is correct) and flags (PRESENT, VIRGIN).
+    """
+    def __init__(self, allowed: np.ndarray, flags: np.ndarray, left: int, top: int, palette_size: int):
+        self.allowed = allowed
+        self.flags = flags
+        self.left = left
+        self.top = top
+        self.palette_size = palette_size
+
+    @property
+    def nbytes(self) -> int:
+        return self.allowed.nbytes + self.flags.nbytes
+
+    def classify(self, x: np.ndarray, y: np.ndarray, index: np.ndarray) -> np.ndarray:
+        """Classify a batch of placements.
+
+        Args:
+            x (np.ndarray): x coordinates on the canvas.
+            y (np.ndarray): y coordinates on the canvas.
+            index (np.ndarray): Palette indices placed (already checked to be within the palette).
+
+        Returns:
+            np.ndarray: Per placement, 1 if it's correct for a template, -1 if it's a grief, 0 if no template covers it.
+        """
+        rows = y - self.top
+        cols = x - self.left
+        inside = (rows >= 0) & (cols >= 0) & (rows < self.flags.shape[0]) & (cols < self.flags.shape[1])
+        verdicts = np.zeros(len(x), dtype=np.int8)
+        rows = rows[inside]
+        cols = cols[inside]
+        flags = self.flags[rows, cols]
+        allowed = self.allowed[rows, cols] >> index[inside].astype(self.allowed.dtype)
+        correct = ((flags & VIRGIN) != 0) | ((allowed & 1) != 0)
+        verdicts[inside] = np.where((flags & PRESENT) != 0, np.where(correct, 1, -1), 0)
+        return verdicts
+
+
+def mask_dtype(palette_size: int):
+    """Smallest unsigned dtype with a bit for every palette index."""
+    for dtype in (np.uint8, np.uint16, np.uint32, np.uint64):
+        if palette_size <= np.iinfo(dtype).bits:
+            return dtype
+    raise ValueError(f'Palettes with more than 64 colours are not supported ({palette_size}).')
+
+
+def pack_rgb(rgb: np.ndarray) -> np.ndarray:
+    """Pack the last (RGB) axis of an array into a single int per pixel."""
+    rgb = rgb.astype(np.uint32)
+    return (rgb[..., 0] << 16) | (rgb[..., 1] << 8) | rgb[..., 2]
+
+
+def load_template_images(paths: list) -> list[tuple[int, int, np.ndarray]]:
+    """Open template images and crop them to their visible area.
+
+    Args:
+        paths (list): Paths to template images.
+
+    Returns:
+        list[tuple[int, int, np.ndarray]]: The left and top offset on the canvas and the cropped RGBA array per template.
+    """
+    images = []
+    for path in paths:
+        try:
+            with Image.open(path) as img:
+                rgba = np.asarray(img.convert('RGBA'))
+        except Exception as e:
+            print(f'Error loading template image {path}: {e}')
+            continue
+        rows = np.flatnonzero(rgba[..., 3].any(axis=1))
+        cols = np.flatnonzero(rgba[..., 3].any(axis=0))
+        if not rows.size:
+            continue
+        top, bottom = rows[0], rows[-1] + 1
+        left, right = cols[0], cols[-1] + 1
+        images.append((int(left), int(top), rgba[top:bottom, left:right]))
+    return images
+
+
+def compile_templates(images: list[tuple[int, int, np.ndarray]], initial_canvas: np.ndarray,
+                      palette: list[tuple[int, int, int]]) -> Optional[TemplateRaster]:
+    """Compile cropped templates into a single TemplateRaster.
+
+    Args:
+        images (list[tuple[int, int, np.ndarray]]): Templates as returned by load_template_images.
+        initial_canvas (np.ndarray): The initial canvas as palette indices (see canvas_assets.load_canvas).
+        palette (list[tuple[int, int, int]]): The canvas palette.
+
+    Returns:
+        Optional[TemplateRaster]: The compiled raster, or None if there are no templates.
+    """
+    if not images:
+        return None
+    dtype = mask_dtype(len(palette))
+    colour_bits = {}
+    for index, colour in enumerate(palette):
+        key = (colour[0] << 16) | (colour[1] << 8) | colour[2]
+        colour_bits[key] = colour_bits.get(key, 0) | (1 << index) # duplicate colours allow both indices
+
+    left = min(img_left for img_left, _, _ in images)
+    top = min(img_top for _, img_top, _ in images)
+    right = max(img_left + rgba.shape[1] for img_left, _, rgba in images)
+    bottom = max(img_top + rgba.shape[0] for _, img_top, rgba in images)
+    allowed = np.zeros((bottom - top, right - left), dtype=dtype)
+    flags = np.zeros((bottom - top, right - left), dtype=np.uint8)
+    known = min(len(palette), UNKNOWN)
+    index_keys = np.full(256, -1, dtype=np.int64) # UNKNOWN pixels never match a template colour
+    index_keys[:known] = palette_keys(palette)[:known]
+
+    for img_left, img_top, rgba in images:
+        height, width = rgba.shape[:2]
+        opaque = rgba[..., 3] > 0
+        keys = pack_rgb(rgba[..., :3])
+        unique_keys, inverse = np.unique(keys, return_inverse=True)
+        key_bits = np.array([colour_bits.get(int(key), 0) for key in unique_keys], dtype=dtype)
+        bits = np.where(opaque, key_bits[inverse.reshape(keys.shape)], 0).astype(dtype)
+
+        # templates hanging over the initial canvas can't be virgin there
+        virgin = np.zeros_like(opaque)
+        initial_height = max(0, min(height, initial_canvas.shape[0] - img_top))
+        initial_width = max(0, min(width, initial_canvas.shape[1] - img_left))
+        initial_area = index_keys[initial_canvas[img_top:img_top + initial_height, img_left:img_left + initial_width]]
+        virgin[:initial_height, :initial_width] = keys[:initial_height, :initial_width] == initial_area
+        virgin &= opaque
+
+        rows = slice(img_top - top, img_top - top + height)
+        cols = slice(img_left - left, img_left - left + width)
+        allowed[rows, cols] |= bits
+        flags[rows, cols] |= np.where(opaque, PRESENT, 0).astype(np.uint8) | np.where(virgin, VIRGIN, 0).astype(np.uint8)
+    return TemplateRaster(allowed, flags, left, top, len(palette))
+
+
+def template_fingerprint(template_paths: list, initial_canvas_path: str, palette: list[tuple[int, int, int]]) -> str:
+    """Hash everything a TemplateRaster is compiled from (template files, initial canvas, palette).
+
+    Args:
+        template_paths (list): Paths to the template images.
+        initial_canvas_path (str): Path to the initial canvas PNG.
+        palette (list[tuple[int, int, int]]): The canvas palette.
+
+    Returns:
+        str: A hex digest that changes whenever any input does.
+    """
+    digest = hashlib.sha256()
+    digest.update(repr(palette).encode())
+    for path in [initial_canvas_path, *sorted(str(path) for path in template_paths)]:
+        digest.update(os.path.basename(path).encode())
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+def save_raster(path: str, raster: Optional[TemplateRaster], fingerprint: str):
+    """Write a compiled TemplateRaster (or the fact there is none) to disk, tagged with its fingerprint."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    arrays = {'fingerprint': np.array(fingerprint)}
+    if raster is not None:
+        arrays['allowed'] = raster.allowed
+        arrays['flags'] = raster.flags
+        arrays['meta'] = np.array([raster.left, raster.top, raster.palette_size], dtype=np.int64)
+    temp_path = f'{path}.{os.getpid()}.tmp'
+    with open(temp_path, 'wb') as f:
+        np.savez(f, **arrays)
+    os.replace(temp_path, path)
+
+
+def load_raster(path: str, fingerprint: Optional[str]) -> tuple[bool, Optional[TemplateRaster]]:
+    """Read a TemplateRaster written by save_raster.
+
+    Args:
+        path (str): The cache file.
+        fingerprint (Optional[str]): The fingerprint the cached raster must have been compiled from. If None, whatever is cached is used.
+
+    Returns:
+        tuple[bool, Optional[TemplateRaster]]: Whether the cache was usable, and the raster (None if the canvas has no templates).
+    """
+    try:
+        with np.load(path) as cached:
+            if fingerprint is not None and str(cached['fingerprint']) != fingerprint:
+                return False, None
+            if 'meta' not in cached.files:
+                return True, None
+            left, top, palette_size = (int(value) for value in cached['meta'])
+            return True, TemplateRaster(cached['allowed'], cached['flags'], left, top, palette_size)
+    except FileNotFoundError:
+        return False, None
+    except Exception as e:
+        print(f'Ignoring broken template cache {path}: {e}')
+        return False, None
+
+
+def build_raster(canvas: str, template_paths: list, palette: list[tuple[int, int, int]], initial_canvas_path: str,
+                 cache_path: str) -> tuple[Optional[TemplateRaster], str]:
+    """Get the compiled templates for a canvas from cache_path, compiling (and caching) them if anything changed.
+
+    Only takes plain arguments so it can run in a worker process.
+
+    Args:
+        canvas (str): The canvas the templates are for.
+        template_paths (list): Paths to the template images.
+        palette (list[tuple[int, int, int]]): The canvas palette.
+        initial_canvas_path (str): Path to the initial canvas PNG.
+        cache_path (str): Where the compiled raster is cached.
+
+    Returns:
+        tuple[Optional[TemplateRaster], str]: The raster (None if there's nothing to compile) and where it came from
+            ('cached', 'compiled', 'empty', 'missing', or 'failed' if a template couldn't be compiled).
+    """
+    if not template_paths:
+        return None, 'empty'
+    try:
+        fingerprint = template_fingerprint(template_paths, initial_canvas_path, palette)
+    except FileNotFoundError as e:
+        print(f'{e}')
+        return None, 'missing'
+    cached, raster = load_raster(cache_path, fingerprint)
+    if cached:
+        return raster, 'cached'
+    initial_canvas = canvas_assets.load_canvas(canvas, 'initial', palette)
+    if initial_canvas is None:
+        return None, 'missing'
+    try:
+        raster = compile_templates(load_template_images(template_paths), initial_canvas, palette)
+    except ValueError as e:
+        print(f'Failed to compile templates for c{canvas}: {e}')
+        return None, 'failed' # not cached, so it's tried again next time (eg. once the template is fixed)
+    save_raster(cache_path, raster, fingerprint)
+    return raster, 'compiled'
@@ -0,0 +1,188 @@
+from collections import Counter
+from typing import Optional
+import numpy as np
+from tib_utility.templates import TemplateRaster
+
+# action codes used in UserLog.action
+PLACE = 0 # 'user place'
+UNDO = 1 # 'user undo'
+OTHER = 2 # anything else (mod overwrites, rollbacks, ...)
+ACTION_CODES = {'user place': PLACE, 'user undo': UNDO}
+COORD_STRIDE = 1 << 16 # wider than any canvas, so y * COORD_STRIDE + x is unique per pixel
+
+
+class UserLog:
+    """A filtered user log loaded into integer arrays, one entry per row (in file order)."""
+    def __init__(self, x: np.ndarray, y: np.ndarray, index: np.ndarray, action: np.ndarray, actions: Counter,
+                 time: Optional[np.ndarray] = None):
+        self.x = x
+        self.y = y
+        self.index = index
+        self.action = action
+        self.actions = actions # count of every raw action string, for undo/mod counting
+        self.time = time # unix milliseconds per row, only if loaded with_time
+
+    def __len__(self) -> int:
+        return len(self.x)
+
+    @property
+    def coord(self) -> np.ndarray:
+        """Linear coordinate per row."""
+        return self.y.astype(np.int64) * COORD_STRIDE + self.x
+
+
+def load_user_log(user_log_file: str, with_time: bool = False) -> UserLog:
+    """Read a filtered user log into a UserLog.
+
+    Args:
+        user_log_file (str): Filepath to a user log file.
+        with_time (bool): Also parse the date column into UserLog.time.
+
+    Returns:
+        UserLog: The parsed log. Rows with less than 6 columns or non-numeric coordinates/indices are skipped.
+    """
+    xs = []
+    ys = []
+    indices = []
+    codes = []
+    dates = []
+    actions = Counter()
+    with open(user_log_file, 'r', encoding='utf-8') as f:
+        for line in f:
+            parts = line.split('\t')
+            if len(parts) < 6:
+                continue
+            try:
+                x = int(parts[2])
+                y = int(parts[3])
+                index = int(parts[4])
+            except ValueError:
+                continue
+            action = parts[5].strip()
+            xs.append(x)
+            ys.append(y)
+            indices.append(index)
+            codes.append(ACTION_CODES.get(action, OTHER))
+            actions[action] += 1
+            if with_time:
+                dates.append(parts[0].replace(',', '.')) # 2024-01-01 12:34:56,789
+    return UserLog(
+        np.array(xs, dtype=np.int32),
+        np.array(ys, dtype=np.int32),
+        np.array(indices, dtype=np.int32),
+        np.array(codes, dtype=np.int8),
+        actions,
+        np.array(dates, dtype='datetime64[ms]').astype(np.int64) if with_time else None
+    )
+
+
+def replay_tpe(log: UserLog, template: TemplateRaster) -> tuple[int, int]:
+    """Replay place/undo events against compiled templates.
+
+    Per pixel, correct placements stack up (and clear griefs), griefs stack up (and clear correct placements)
+    and undos take one off whichever is there. Only the last run of same-kind placements per pixel survives,
+    and within that run the count is a walk (+1 place, -1 undo) that can't drop below zero, so it's
+    worked out per pixel with grouped cumulative sums rather than one row at a time.
+
+    Args:
+        log (UserLog): The user log.
+        template (TemplateRaster): The compiled templates for the canvas.
+
+    Returns:
+        tuple[int, int]: Correct pixels (tpe_place - tpe_grief) and grief pixels (tpe_grief).
+    """
+    index = np.where(log.index < 0, log.index + template.palette_size, log.index) # same as indexing into the palette
+    valid = (log.action != OTHER) & (index >= 0) & (index < template.palette_size)
+    places = np.flatnonzero(valid & (log.action == PLACE))
+    kinds = np.zeros(len(log), dtype=np.int8) # +1 correct, -1 grief, 0 undo/not on a template
+    kinds[places] = template.classify(log.x[places], log.y[places], index[places])
+    keep = (valid & (log.action == UNDO)) | (kinds != 0)
+    coords = log.coord[keep]
+    kinds = kinds[keep]
+    if not len(coords):
+        return 0, 0
+
+    order = np.argsort(coords, kind='stable')
+    coords = coords[order]
+    kinds = kinds[order]
+    positions = np.arange(len(coords))
+    starts = np.flatnonzero(np.r_[True, coords[1:] != coords[:-1]])
+    group = np.repeat(np.arange(len(starts)), np.diff(np.r_[starts, len(coords)]))
+
+    # which kind of placement each pixel ends on, and where the last placement of the other kind is
+    last_place = np.maximum.reduceat(np.where(kinds != 0, positions, -1), starts)
+    final_kind = np.where(last_place >= 0, kinds[np.maximum(last_place, 0)], 0)
+    opposite = (kinds != 0) & (kinds != final_kind[group])
+    last_opposite = np.maximum.reduceat(np.where(opposite, positions, -1), starts)
+    in_run = (positions > last_opposite[group]) & (final_kind[group] != 0)
+    if not in_run.any():
+        return 0, 0
+
+    steps = np.where(kinds[in_run] != 0, 1, -1)
+    run_group = group[in_run]
+    run_starts = np.flatnonzero(np.r_[True, run_group[1:] != run_group[:-1]])
+    run_ends = np.r_[run_starts[1:], len(steps)] - 1
+    walk = np.cumsum(steps)
+    base = np.where(run_starts > 0, walk[np.maximum(run_starts - 1, 0)], 0)
+    walk -= np.repeat(base, run_ends - run_starts + 1)
+    lowest = np.minimum(np.minimum.reduceat(walk, run_starts), 0)
+    counts = walk[run_ends] - lowest
+    run_kinds = final_kind[run_group[run_starts]]
+    tpe_pixels = int(counts[run_kinds > 0].sum())
+    tpe_griefs = int(counts[run_kinds < 0].sum())
+    return tpe_pixels - tpe_griefs, tpe_griefs # I return tpe_pixels - tpe_griefs, so I don't have to do that math everywhere else lol
+
+
+def read_user_log(user_log_file: str, template: Optional[TemplateRaster] = None) -> dict:
+    """Read a filtered user log once and collect every stat a placemap needs.
+
+    Args:
+        user_log_file (str): Filepath to a user log file.
+        template (Optional[TemplateRaster]): The compiled templates for the canvas. If None, TPE counting is skipped.
+
+    Returns:
+        dict: total_pixels, undo, mod, active_x, active_y, active_count, replaced_user, final_state
+            (x, y and palette index arrays of the last placement on every pixel that wasn't undone), tpe_pixels and tpe_griefs.
+    """
+    log = load_user_log(user_log_file)
+    undo = sum(count for action, count in log.actions.items() if 'undo' in action)
+    mod = sum(count for action, count in log.actions.items() if 'mod' in action)
+    place = int(np.count_nonzero(log.action == PLACE))
+
+    active_x, active_y, active_count = 0, 0, 0
+    final_state = (np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.int32))
+    replaced_user = 0
+    if len(log):
+        coords = log.coord
+        # most active pixel, ties go to whichever showed up first in the log
+        unique_coords, first_seen, activity = np.unique(coords, return_index=True, return_counts=True)
+        busiest = np.flatnonzero(activity == activity.max())
+        most_active = busiest[np.argmin(first_seen[busiest])]
+        active_y, active_x = divmod(int(unique_coords[most_active]), COORD_STRIDE)
+        active_count = int(activity[most_active])
+
+        # final state: a place sets the pixel, an undo clears it
+        rows = np.flatnonzero(log.action != OTHER)
+        order = rows[np.argsort(coords[rows], kind='stable')]
+        sorted_coords = coords[order]
+        same_as_prev = np.r_[False, sorted_coords[1:] == sorted_coords[:-1]]
+        is_place = log.action[order] == PLACE
+        prev_place = np.r_[False, is_place[:-1]]
+        replaced_user = int(np.count_nonzero(is_place & same_as_prev & prev_place))
+        is_last = np.r_[sorted_coords[1:] != sorted_coords[:-1], True]
+        final_rows = order[is_last & is_place]
+        final_state = (log.x[final_rows], log.y[final_rows], log.index[final_rows])
+
+    tpe_pixels, tpe_griefs = replay_tpe(log, template) if template is not None else (0, 0)
+    return {
+        'total_pixels': place - undo,
+        'undo': undo,
+        'mod': mod,
+        'active_x': active_x,
+        'active_y': active_y,
+        'active_count': active_count,
+        'replaced_user': replaced_user,
+        'final_state': final_state,
+        'tpe_pixels': tpe_pixels,
+        'tpe_griefs': tpe_griefs,
+    }
@@ -0,0 +1,70 @@
+import os
+from typing import Optional
+import numpy as np
+import tib_utility.config as config
+import tib_utility.canvas_assets as canvas_assets
+import tib_utility.userlog as userlog
+import tib_utility.templates as templates
+import tib_utility.placemap_render as placemap_render
+from tib_utility.budget_cache import BudgetCache
+
+# compiled templates each worker process has read from the template cache, keyed by (path, mtime)
+worker_templates = BudgetCache('Worker template cache', config.process_budget(config.template_cache_budget()),
+                               lambda template: template.nbytes if template is not None else 0)
+
+
+def cached_template(cache_path: str) -> Optional[templates.TemplateRaster]:
+    """Read a canvas's compiled templates from the on-disk template cache, once per worker process (until the file changes).
+
+    Raises:
+        FileNotFoundError: If there's no usable cache file.
+    """
+    key = (cache_path, os.stat(cache_path).st_mtime_ns)
+    missing = object()
+    template = worker_templates.get(key, missing)
+    if template is missing:
+        cached, template = templates.load_raster(cache_path, None)
+        if not cached:
+            raise FileNotFoundError(f'No usable template cache at {cache_path}.')
+        worker_templates[key] = template
+    return template
+
+
+def read_user_log_cached(user_log_file: str, cache_path: str) -> dict:
+    """userlog.read_user_log with the templates from the template cache, so the raster isn't sent along with every job."""
+    return userlog.read_user_log(user_log_file, cached_template(cache_path))
+
+
+def survival_counts(final_state: tuple[np.ndarray, np.ndarray, np.ndarray], canvas: str,
+                    palette: list[tuple[int, int, int]]) -> tuple[int, int]:
+    """Compare a user's final placements against the final canvas.
+
+    Args:
+        final_state (tuple[np.ndarray, np.ndarray, np.ndarray]): x, y and palette index of the user's final placement per pixel.
+        canvas (str): The canvas to compare against.
+        palette (list[tuple[int, int, int]]): The canvas palette.
+
+    Returns:
+        tuple[int, int]: The number of pixels replaced by other users, and the number of pixels that survived.
+    """
+    if not palette:
+        return 0, 0
+    final_canvas = canvas_assets.load_canvas(canvas, 'final', palette)
+    if final_canvas is None:
+        return 0, 0
+    x, y, index = final_state
+    height, width = final_canvas.shape
+    index = np.where(index < 0, index + len(palette), index) # same as indexing into the palette
+    inside = (x >= 0) & (y >= 0) & (x < width) & (y < height) & (index >= 0) & (index < len(palette))
+    keys = canvas_assets.palette_keys(palette)
+    final_index = final_canvas[y[inside], x[inside]].astype(np.int64)
+    final_keys = keys[np.where(final_index < len(palette), final_index, -1)] # UNKNOWN ends up on the -1 key
+    survived = int(np.count_nonzero(keys[index[inside]] == final_keys))
+    replaced_other = int(np.count_nonzero(inside)) - survived  # UNUSED
+    return replaced_other, survived
+
+
+def render_native(user_log_file: str, mode: str, palette: list[tuple[int, int, int]], bg: str) -> bytes:
+    """Render a placemap in-process (no render.exe), returning the PNG."""
+    log = userlog.load_user_log(user_log_file, with_time=(mode == 'age'))
+    return placemap_render.render_png(log, bg, palette, mode)
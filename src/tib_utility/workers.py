@@ -0,0 +1,57 @@
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Optional
+import tib_utility.config as config
+
+worker_pool: Optional[ProcessPoolExecutor] = None
+worker_stats = {'jobs': 0, 'failed': 0, 'restarts': 0}
+
+
+class WorkerDied(RuntimeError):
+    """A worker process died while running a job."""
+
+
+def get_worker_pool() -> ProcessPoolExecutor:
+    """The worker processes, started on first use."""
+    global worker_pool
+    if worker_pool is None:
+        worker_pool = ProcessPoolExecutor(max_workers=config.worker_processes(), mp_context=multiprocessing.get_context('spawn'))
+    return worker_pool
+
+
+def reset_worker_pool(broken: ProcessPoolExecutor):
+    """Replace a pool that lost a worker (only once, if several jobs notice at the same time)."""
+    global worker_pool
+    if worker_pool is broken:
+        worker_pool = None
+        worker_stats['restarts'] += 1
+        broken.shutdown(wait=False, cancel_futures=True)
+
+
+async def run(func: Callable, *args):
+    """Run a CPU heavy job (analysis, native rendering, ...) in a worker process, off the Discord gateway's process.
+
+    With WORKER_PROCESSES=0 the job runs in a thread in this process instead.
+    func and its arguments must be picklable (module level functions, plain data and numpy arrays).
+
+    Raises:
+        WorkerDied: If the worker running the job died. The workers are restarted for the next job.
+    """
+    worker_stats['jobs'] += 1
+    if config.worker_processes() == 0:
+        return await asyncio.to_thread(func, *args)
+    pool = get_worker_pool()
+    try:
+        return await asyncio.get_running_loop().run_in_executor(pool, func, *args)
+    except BrokenProcessPool as e:
+        worker_stats['failed'] += 1
+        print(f'A worker died while running {func.__name__}, restarting the workers.')
+        reset_worker_pool(pool)
+        raise WorkerDied(f'A worker died while running {func.__name__}.') from e
+
+
+def shutdown():
+    if worker_pool is not None:
+        worker_pool.shutdown(cancel_futures=True)